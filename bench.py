@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This software is hereby released into public domain. Use it wisely.
+#
+# Benchmarks for lc4.py and ls47.py: derive_key, encrypt/decrypt for
+# several message sizes, both ciphers and both marker modes, and the
+# nonce/padding wrappers, in letters per second and peak allocated memory.
+# The results can be saved as a baseline and compared with a later run.
+# The correctness checks (known-answer vectors, reference implementations,
+# round trips) are the tests: python -m pytest -q (test_bench.py runs these
+# cases under pytest-benchmark).
+#
+# Sample calls:
+# python bench.py --sizes 10,1000,100000 --save baseline.json
+# python bench.py --sizes 10,1000,100000 --compare baseline.json --threshold 0.2
+#
+# Exit status: 0 = fine, 1 = performance regression.
+
+import sys
+import json
+import time
+import random
+import argparse
+import tracemalloc
+
+import lc4
+import ls47
+
+
+def measure(fn, letters, min_time):
+    """Run fn repeatedly for at least min_time seconds; return letters/second."""
+    n = 0
+    start = time.perf_counter()
+    while True:
+        fn()
+        n += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return letters * n / elapsed
+
+
+def peak_memory(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def cases(sizes):
+    """Yield (name, letters processed per call, function) benchmark cases."""
+    rnd = random.Random(1)
+    for size in (6, 7):
+        cipher = lc4.Cipher(size, key_cache=lc4.KeyCache(0))
+        keyword = ''.join(rnd.choice(cipher.letters) for i in range(20))
+        yield ("lc4 -%d derive_key" % size, len(keyword),
+               lambda cipher=cipher, keyword=keyword: cipher.derive_key(keyword))
+    keyword = ''.join(rnd.choice(ls47.letters) for i in range(20))
+    yield ("ls47 derive_key", len(keyword), lambda: ls47._derive_key(keyword))
+
+    for n in sizes:
+        for size in (6, 7):
+            for mm in (1, 2):
+                cipher = lc4.Cipher(size, marker_mode=mm)
+                key = cipher.derive_key('benchmark')
+                text = ''.join(rnd.choice(cipher.letters) for i in range(n))
+                name = "lc4 -%d -m%d %%s %d" % (size, mm - 1, n)
+                yield (name % "encrypt", n, lambda c=cipher, k=key, t=text: c.encrypt(k, t))
+                yield (name % "decrypt", n, lambda c=cipher, k=key, t=text: c.decrypt(k, t))
+            cipher = lc4.Cipher(size, prefix_cache=lc4.PrefixCache(0))
+            key = cipher.derive_key('benchmark')
+            nonce = cipher.create_random_nonce(10)
+            ct = cipher.encrypt_with_nonce(key, text, nonce)
+            name = "lc4 -%d %%s %d" % (size, n)
+            yield (name % "encrypt_with_nonce", n,
+                   lambda c=cipher, k=key, t=text, nc=nonce: c.encrypt_with_nonce(k, t, nc))
+            yield (name % "decrypt_with_nonce", n,
+                   lambda c=cipher, k=key, t=ct: c.decrypt_with_nonce(k, t, 10))
+        key = ls47.derive_key('benchmark')
+        text = ''.join(rnd.choice(ls47.letters) for i in range(n))
+        yield ("ls47 encrypt %d" % n, n, lambda k=key, t=text: ls47.encrypt(k, t))
+        yield ("ls47 decrypt %d" % n, n, lambda k=key, t=text: ls47.decrypt(k, t))
+        yield ("ls47 encrypt_pad %d" % n, n, lambda k=key, t=text: ls47.encrypt_pad(k, t, 'sig'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for lc4.py and ls47.py")
+    parser.add_argument("--sizes", metavar="N,N,...", help="message sizes to benchmark (default: 10,1000,100000; up to 10000000 takes long)",
+                        default="10,1000,100000")
+    parser.add_argument("--min-time", metavar="SECONDS", help="minimum time spent in each case (default: 0.2)", type=float, default=0.2)
+    parser.add_argument("--filter", metavar="TEXT", help="only run the cases whose name contains TEXT")
+    parser.add_argument("--save", metavar="FILE", help="store the results as a baseline in FILE")
+    parser.add_argument("--compare", metavar="FILE", help="compare the results with the baseline in FILE")
+    parser.add_argument("--threshold", metavar="FRACTION", help="slowdown against the baseline counted as a regression (default: 0.2)",
+                        type=float, default=0.2)
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = []
+    sizes = [int(n) for n in args.sizes.split(',')]
+    for (name, letters, fn) in cases(sizes):
+        if args.filter and args.filter not in name:
+            continue
+        rate = measure(fn, letters, args.min_time)
+        peak = peak_memory(fn)
+        results[name] = dict(rate=rate, peak=peak)
+        line = "%-36s %14.0f letters/s %12d B peak" % (name, rate, peak)
+        if name in baseline:
+            ratio = rate / baseline[name]['rate']
+            line += "  %6.2fx" % ratio
+            if ratio < 1 - args.threshold:
+                regressions.append(name)
+                line += "  REGRESSION"
+        print(line)
+        sys.stdout.flush()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    if regressions:
+        print("%d regression(s) against %s" % (len(regressions), args.compare), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
-#!/usr/bin/python2
+#!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 # This software is hereby released into public domain. Use it wisely.
 #
@@ -44,28 +44,323 @@
 # python lc4.py -t  -ws s3cret_p4sswxyz  -s peacevector_34
 
 
-from __future__ import print_function
 import sys
 import os
-import random
 import argparse
+import json
+import multiprocessing
+import threading
+import collections
+import itertools
+import bisect
+import unicodedata
+import struct
+import hashlib
+import mmap
+import collections.abc
+import time
+import atexit
 
 
 version = "v2.8.1 (2018-07-24)"
 
+
 # define alphabet
 letters6     = "#_23456789abcdefghijklmnopqrstuvwxyz"
 letters6card = "abcdefghijklmnopqrstuvwxyz_23456789#"
 letters7     = "_abcdefghijklmnopqrstuvwxyz.0123456789,-+*/:?!'()"
 letters7card = "abcdefghijklmnopqrstuvwxyz_.,-+*/:?!'()1234567890"
+letters8     = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
+
+# named alphabets, see register_alphabet()
+named_alphabets = {
+    'lc4': letters6,
+    'lc4card': letters6card,
+    'ls47': letters7,
+    'ls47card': letters7card,
+    'base64': letters8,
+}
+
+
+# the playing card alphabets, which go with one-indexed key derivation
+card_alphabets = (letters6card, letters7card)
+
+
+def default_letters(size, playingcard=False):
+    if size == 7:
+        return letters7card if playingcard else letters7
+    if size == 6:
+        return letters6card if playingcard else letters6
+    raise ValueError("Unsupported size %r: use 6 (LC4) or 7 (LS47), or give an alphabet" % (size,))
+
+
+def register_alphabet(name, letters):
+    """
+    Make the alphabet letters (size*size distinct ASCII letters, in the order
+    of the tiles on the board) available under name, e.g. for Cipher or the
+    --alphabet option.
+    """
+    get_alphabet(letters)
+    named_alphabets[name] = letters
+
+
+class LetterPool(object):
+    """
+    Uniformly random letters of an alphabet, for nonces and padding. Random
+    bytes are drawn from os.urandom in bulk and mapped to letters by a single
+    bytes.translate() pass which also drops the bytes above the largest
+    multiple of the alphabet size (rejection sampling, so that the letters
+    are unbiased). The pool is refilled as needed, and discarded in forked
+    child processes so that they do not reuse the parent's letters.
+    """
+
+    def __init__(self, letters, bulk=4096):
+        n = len(letters)
+        letterbytes = letters.encode('ascii')
+        self.table = bytes(letterbytes[b % n] for b in range(256))
+        self.reject = bytes(range(256 - 256 % n, 256))
+        self.bulk = bulk
+        self._letters = ''
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def take(self, n):
+        if n < 0:
+            raise ValueError("Cannot take %d random letters" % n)
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._letters = ''
+            while len(self._letters) < n:
+                data = os.urandom(max(self.bulk, 2 * n))
+                self._letters += data.translate(self.table, self.reject).decode('ascii')
+            (out, self._letters) = (self._letters[:n], self._letters[n:])
+            return out
+
+
+class Alphabet(object):
+    """
+    Lookup tables for one alphabet, built once per alphabet (see get_alphabet):
+    letter -> index, index -> tile position (also as separate row and column
+    tables), and the byte -> index (0xff for non-letters, which doubles as
+    the membership test) and index -> byte translation tables which convert
+    whole texts at once. Random letters come from its LetterPool.
+    """
+
+    def __init__(self, letters):
+        size = int(round(len(letters) ** 0.5))
+        if size < 2 or size * size != len(letters) or len(set(letters)) != len(letters):
+            raise ValueError("Alphabet must consist of size*size distinct letters: '%s'" % letters)
+        if any(ord(l) >= 128 for l in letters):
+            raise ValueError("Alphabet must consist of ASCII letters: '%s'" % letters)
+        self.letters = letters
+        self.size = size
+        self.index = dict((l, i) for (i, l) in enumerate(letters))
+        self.tiles = [(i // size, i % size) for i in range(size * size)]
+        self.rows = [i // size for i in range(size * size)]
+        self.cols = [i % size for i in range(size * size)]
+        self.letterset = frozenset(letters)
+        self.letterbytes = letters.encode('ascii')
+        to_index = bytearray(b'\xff' * 256)
+        for (i, b) in enumerate(self.letterbytes):
+            to_index[b] = i
+        self.to_index = bytes(to_index)
+        self.to_letter = self.letterbytes + b'\0' * (256 - len(letters))
+        self.pool = LetterPool(letters)
+
+    def find_ix(self, letter):
+        i = self.index.get(letter)
+        if i is None:
+            raise ValueError("Letter '%c' not in the alphabet!" % letter)
+        return self.tiles[i]
+
+    def indices(self, s):
+        """Bytes with the indices of the letters of s; ValueError on others."""
+        try:
+            ix = s.encode('ascii').translate(self.to_index)
+        except UnicodeError:
+            ix = b'\xff'
+        if b'\xff' in ix:
+            raise ValueError("Letter '%c' not in the alphabet!" % self.illegal(s)[0])
+        return ix
+
+    def text(self, ix):
+        """Inverse of indices()."""
+        return bytes(ix).translate(self.to_letter).decode('ascii')
+
+    def illegal(self, s):
+        """Sorted string of the distinct letters of s not in the alphabet."""
+        return ''.join(sorted(set(s).difference(self.letterset)))
+
+
+alphabets = {}
+
+
+def get_alphabet(letters):
+    a = alphabets.get(letters)
+    if a is None:
+        a = alphabets[letters] = Alphabet(letters)
+    return a
+
+
+# replacements tried by NormalizeTable for characters not in the alphabet
+# (after the other case, before the accent-stripping decomposition)
+substitutes = {
+    '\u00df': 'ss', '\u00e6': 'ae', '\u0153': 'oe', '\u00f8': 'o', '\u0111': 'd', '\u0142': 'l',
+    '\u2018': "'", '\u2019': "'", '\u201c': '"', '\u201d': '"', '\u2013': '-', '\u2014': '-',
+    '\u2026': '...', '"': "'",
+}
+
+
+class NormalizeTable(dict):
+    """
+    str.translate() table which maps free text into an alphabet: letters
+    are kept, other characters are replaced by the same letter in the other
+    case, by their substitutes, or by their decomposition without accents
+    (as long as the replacement is in the alphabet), whitespace becomes '_'
+    and anything else is dropped. Latin-1 is mapped up front, other
+    characters on first use. deletes is the table which drops the letters.
+    """
+
+    def __init__(self, alphabet):
+        dict.__init__(self)
+        self.letters = alphabet.letters
+        self.deletes = dict.fromkeys(map(ord, alphabet.letters))
+        for code in range(256):
+            self[code]
+
+    def __missing__(self, code):
+        out = self[code] = self._map(chr(code))
+        return out
+
+    def _map(self, ch):
+        letters = self.letters
+        for c in (ch, ch.lower(), ch.upper()):
+            if c in letters:
+                return c
+        sub = substitutes.get(ch)
+        if sub is None:
+            sub = ''.join(c for c in unicodedata.normalize('NFKD', ch) if not unicodedata.combining(c))
+        if sub and sub != ch:
+            out = [self._map(c) for c in sub]
+            if all(out):
+                return ''.join(out)
+        if ch.isspace() and '_' in letters:
+            return '_'
+        return None
+
+
+normalize_tables = {}
+
+
+class Normalizer(object):
+    """
+    Maps free text into the alphabet with its NormalizeTable (shared per
+    alphabet), counting the characters it altered (replaced or dropped).
+    """
+
+    def __init__(self, alphabet):
+        table = normalize_tables.get(alphabet.letters)
+        if table is None:
+            table = normalize_tables[alphabet.letters] = NormalizeTable(alphabet)
+        self.table = table
+        self.altered = 0
+
+    def __call__(self, text):
+        altered = len(text.translate(self.table.deletes))
+        if not altered:
+            return text
+        self.altered += altered
+        return text.translate(self.table)
+
+
+class NormalizingEncryptor(object):
+    """
+    StreamEncryptor s whose plaintext chunks are normalized first; the
+    signature is appended by final() as it is, without normalizing it.
+    """
+
+    def __init__(self, s, normalizer, signature=''):
+        self.s = s
+        self.normalize = normalizer
+        self.signature = signature
+
+    @property
+    def nonce(self):
+        return self.s.nonce
+
+    @property
+    def nonce_enc(self):
+        return self.s.nonce_enc
+
+    def update(self, plaintext):
+        return self.s.update(self.normalize(plaintext))
+
+    def final(self):
+        return self.s.update(self.signature) + self.s.final()
+
+
+class SignatureCheck(object):
+    """
+    Checks that a plaintext passed through it in chunks ends with signature,
+    keeping only the last len(signature) letters in a ring buffer. With
+    strip, those letters are held back, so that the text passed on is the
+    plaintext without the signature.
+    """
+
+    def __init__(self, signature, strip=False):
+        self.signature = signature
+        self.strip = strip
+        self.tail = collections.deque(maxlen=len(signature))
+
+    def __call__(self, text):
+        n = len(self.signature)
+        if not self.strip:
+            self.tail.extend(text[-n:] if n else '')
+            return text
+        text = ''.join(self.tail) + text
+        self.tail.clear()
+        if not n:
+            return text
+        self.tail.extend(text[-n:])
+        return text[:-n]
+
+    @property
+    def ok(self):
+        return ''.join(self.tail) == self.signature
+
+
+class VerifyingDecryptor(object):
+    """StreamDecryptor s whose plaintext goes through the SignatureCheck check."""
+
+    def __init__(self, s, check):
+        self.s = s
+        self.check = check
+
+    @property
+    def nonce(self):
+        return self.s.nonce
+
+    @property
+    def nonce_enc(self):
+        return self.s.nonce_enc
+
+    def update(self, ciphertext):
+        return self.check(self.s.update(ciphertext))
+
+    def final(self):
+        return self.check(self.s.final())
 
 
 def missing_letters(s,t):
-    return ''.join(sorted(set(c for c in s if c not in t)))
+    return ''.join(sorted(set(s).difference(t)))
 
 
-def check_key(key):
-    illegal = missing_letters(key,letters)
+def check_key(key, alphabet):
+    letters = alphabet.letters
+    if len(key) == len(letters) and set(key) == alphabet.letterset:
+        return
+    illegal = alphabet.illegal(key)
     missing = missing_letters(letters,key)
     duplicates = ''.join(sorted(c for c in letters if key.count(c)>1))
 
@@ -79,251 +374,1629 @@ def check_key(key):
         raise ValueError("\n".join(errors))
 
 
-def check_nonce(nonce):
-    illegal = missing_letters(nonce,letters)
+def check_nonce(nonce, alphabet):
+    illegal = alphabet.illegal(nonce)
     if illegal:
         raise ValueError("Nonce contains illegal letters: '%s'" % illegal)
 
 
-def check_plaintext(s):
-    illegal = missing_letters(s,letters)
+def check_plaintext(s, alphabet):
+    illegal = alphabet.illegal(s)
     if illegal:
         raise ValueError("Plaintext contains illegal letters: '%s'" % illegal)
 
 
-def check_ciphertext(s):
-    illegal = missing_letters(s,letters)
+def check_ciphertext(s, alphabet):
+    illegal = alphabet.illegal(s)
     if illegal:
         raise ValueError("Ciphertext contains illegal letters: '%s'" % illegal)
 
 
-def find_ix(letter):
-    m = [l[1] for l in tiles if l[0] == letter]
-    if len(m) != 1:
-        raise ValueError("Letter '%c' not in the alphabet!" % letter)
-    return m[0]
-
-
-def find_pos(key, letter):
-    p = key.find(letter)
-    if not (0 <= p < size * size):
-        raise ValueError("Letter '%c' not in key?!" % letter)
-    return (p // size, p % size)
-
-
-def add_pos(a, b):
-    return ((a[0] + b[0]) % size, (a[1] + b[1]) % size)
-
-
-def sub_pos(a, b):
-    return ((a[0] - b[0]) % size, (a[1] - b[1]) % size)
-
-
-def find_at_pos(key, coord):
-    return key[coord[1] + coord[0] * size]
-
-
-def rotate_right(key, row, n):
-    mid = key[size * row:size * (row + 1)]
-    return key[:size * row] + mid[-n:] + mid[:-n] + key[size * (row + 1):]
-
-
-def rotate_down(key, col, n):
-    lines  = [key[i * size:(i + 1) * size] for i in range(size)]
-    lefts  = [l[:col] for l in lines]
-    mids   = [l[col] for l in lines]
-    rights = [l[col + 1:] for l in lines]
-    mids = mids[-n:] + mids[:-n]
-    return ''.join(lefts[i] + mids[i] + rights[i] for i in range(size))
-
-
-def rotate_marker_right(m, row, n):
-    if m[0] != row:
-        return (m[0], m[1])
-    else:
-        return (m[0], (m[1] + n) % size)
-
-
-def rotate_marker_down(m, col, n):
-    if m[1] != col:
-        return (m[0], m[1])
-    else:
-        return ((m[0] + n) % size, m[1])
-
-
-def derive_key(password, one_indexed):
+def derive_key(password, one_indexed, alphabet):
+    size = alphabet.size
     i = 0
-    k = letters
+    k = alphabet.letters
     # if using one-indexed arrays, moves the zero element to the end
     if one_indexed: k = k[1:]+k[0]
+    state = State(k, alphabet, 1)
     for c in password:
-        (row, col) = find_ix(c)
-        k = rotate_down(rotate_right(k, i, col), i, row)
+        (row, col) = alphabet.find_ix(c)
+        state.rotate_row(i, col)
+        state.rotate_col(i, row)
         i = (i + 1) % size
-    return k
-
-
-def encrypt(plaintext):
-    global key, mp
-
-    ciphertext = ''
-    for p in plaintext:
-        pp = find_pos(key, p)
-        mix = find_ix(find_at_pos(key, mp))
-        cp = add_pos(pp, mix)
-        c = find_at_pos(key, cp)
-        ciphertext += c
-
-        key = rotate_right(key, pp[0], 1)
-        if marker_mode==1: mp = rotate_marker_right(mp, pp[0], 1)
-        cp = find_pos(key, c)
-        key = rotate_down(key, cp[1], 1)
-        if marker_mode==1: mp = rotate_marker_down(mp, cp[1], 1)
-        mp = add_pos(mp, find_ix(c))
-    return ciphertext
-
-
-def decrypt(ciphertext):
-    global key, mp
-
-    plaintext = ''
-    for c in ciphertext:
-        cp = find_pos(key, c)
-        mix = find_ix(find_at_pos(key, mp))
-        pp = sub_pos(cp, mix)
-        p = find_at_pos(key, pp)
-        plaintext += p
-
-        key = rotate_right(key, pp[0], 1)
-        if marker_mode==1: mp = rotate_marker_right(mp, pp[0], 1)
-        cp = find_pos(key, c)
-        key = rotate_down(key, cp[1], 1)
-        if marker_mode==1: mp = rotate_marker_down(mp, cp[1], 1)
-        mp = add_pos(mp, find_ix(c))
-    return plaintext
-
-
-def create_random_nonce(size):
-    return ''.join(random.choice(letters) for i in range(size))
-
-
-def encrypt_with_nonce(plaintext):
-    global nonce, nonce_enc
-
-    ciphertext = encrypt(nonce + plaintext)
-    nonce_enc = ciphertext[:nonce_size]
-
-    if nonce_mode==1:
-        return nonce + ciphertext[nonce_size:]
+    return state.key
+
+
+class LRUCache(object):
+    """
+    Bounded, thread-safe least-recently-used mapping, with hit/miss
+    counters. A capacity of 0 disables it.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, k):
+        with self._lock:
+            v = self._items.pop(k, None)
+            if v is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._items[k] = v
+            return v
+
+    def put(self, k, v):
+        with self._lock:
+            self._items[k] = v
+            self._trim()
+
+    def invalidate(self, match=None):
+        """Forget the items whose key satisfies match, or all of them."""
+        with self._lock:
+            if match is None:
+                self._items.clear()
+                return
+            for k in list(self._items):
+                if match(k):
+                    del self._items[k]
+
+    def resize(self, capacity):
+        with self._lock:
+            self.capacity = capacity
+            self._trim()
+
+    def stats(self):
+        with self._lock:
+            return dict(size=len(self._items), capacity=self.capacity,
+                        hits=self.hits, misses=self.misses)
+
+    def _trim(self):
+        while len(self._items) > self.capacity:
+            self._items.popitem(last=False)
+
+
+class KeyCache(LRUCache):
+    """
+    Cache of derive_key() results, keyed by the password, the alphabet and
+    one_indexed.
+    """
+
+    def __init__(self, capacity=256):
+        LRUCache.__init__(self, capacity)
+
+    def derive_key(self, password, one_indexed, alphabet):
+        k = (password, alphabet.letters, bool(one_indexed))
+        key = self.get(k)
+        if key is None:
+            key = derive_key(password, one_indexed, alphabet)
+            self.put(k, key)
+        return key
+
+    def invalidate(self, password=None, letters=None):
+        """
+        Forget the keys derived from password (in the alphabet letters), or
+        all keys if neither is given.
+        """
+        if password is None and letters is None:
+            LRUCache.invalidate(self)
+        else:
+            LRUCache.invalidate(self, lambda k: password in (None, k[0]) and letters in (None, k[1]))
+
+
+class PrefixCache(LRUCache):
+    """
+    Snapshots of the cipher state after a given prefix (a common header, or
+    a nonce which is used again) was processed with a given key, for the
+    callers that ask for it, see Cipher.encrypt_prefix().
+    """
+
+    def __init__(self, capacity=64):
+        LRUCache.__init__(self, capacity)
+
+
+default_key_cache = KeyCache()
+default_prefix_cache = PrefixCache()
+
+
+timer = time.perf_counter
+
+
+class Profile(object):
+    """
+    Counters and timings (in seconds) collected by a Cipher created with
+    profile=Profile(): the phases of the per-letter loop (find_pos, find_ix,
+    rotate_right, rotate_down, marker), letters processed, key derivations
+    and input validation. Without a profile, nothing is measured.
+    """
+
+    phases = ('find_pos', 'find_ix', 'rotate_right', 'rotate_down', 'marker')
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.seconds = collections.Counter()
+        self.start = timer()
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, count=1):
+        with self._lock:
+            self.counts[name] += count
+            self.seconds[name] += seconds
+
+    def report(self):
+        with self._lock:
+            total = timer() - self.start
+            letters = self.counts['letters']
+            return dict(counts=dict(self.counts), seconds=dict(self.seconds), total_seconds=total,
+                        letters_per_second=letters / self.seconds['letters'] if letters else 0.0)
+
+    def dump(self, filename):
+        """Write report() to filename as JSON."""
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=1, sort_keys=True)
+
+
+class State(object):
+    """
+    Running cipher state (the board and the marker position), which allows a
+    message to be processed in several consecutive chunks.
+
+    The engine works for any size*size alphabet. The board is a bytearray of
+    letter indices (position -> letter) kept together with the inverse list
+    (letter -> position), so finding letters is O(1) and the rows and columns
+    are rotated in place.
+    """
+
+    def __init__(self, key, alphabet, marker_mode, mp=(0, 0), profile=None):
+        self.alphabet = alphabet
+        self.marker_mode = marker_mode
+        self.mp = mp
+        self.profile = profile
+        self.offset = 0
+        self.board = bytearray(alphabet.index[c] for c in key)
+        self.pos = [0] * len(self.board)
+        for (i, l) in enumerate(self.board):
+            self.pos[l] = i
+
+    def export(self):
+        """
+        The state in a compact JSON-serializable form: the alphabet, the
+        board as a key string, the marker position, the number of letters
+        processed so far and the marker mode. See State.restore().
+        """
+        return dict(letters=self.alphabet.letters, board=self.key, mp=list(self.mp),
+                    offset=self.offset, marker_mode=self.marker_mode)
+
+    @staticmethod
+    def restore(data, profile=None):
+        """Recreate a State exported by State.export()."""
+        alphabet = get_alphabet(data['letters'])
+        check_key(data['board'], alphabet)
+        mp = tuple(data['mp'])
+        if len(mp) != 2 or not all(0 <= n < alphabet.size for n in mp):
+            raise ValueError("Invalid marker position: %r" % (mp,))
+        if data['marker_mode'] not in (1, 2):
+            raise ValueError("Invalid marker mode: %r" % data['marker_mode'])
+        state = State(data['board'], alphabet, data['marker_mode'], mp, profile)
+        state.offset = data['offset']
+        return state
+
+    @property
+    def key(self):
+        """The current board, as a key string."""
+        return self.alphabet.text(self.board)
+
+    def copy(self):
+        state = State.__new__(State)
+        state.__dict__.update(self.__dict__)
+        state.board = bytearray(self.board)
+        state.pos = list(self.pos)
+        return state
+
+    def rotate_row(self, row, n=1):
+        """Rotate the row n positions to the right."""
+        size = self.alphabet.size
+        n %= size
+        if not n:
+            return
+        b = self.board
+        base = row * size
+        end = base + size
+        b[base:end] = b[end - n:end] + b[base:end - n]
+        pos = self.pos
+        for i in range(base, end):
+            pos[b[i]] = i
+
+    def rotate_col(self, col, n=1):
+        """Rotate the column n positions down."""
+        size = self.alphabet.size
+        n %= size
+        if not n:
+            return
+        b = self.board
+        line = b[col::size]
+        b[col::size] = line[-n:] + line[:-n]
+        pos = self.pos
+        for i in range(col, size * size, size):
+            pos[b[i]] = i
+
+    def encrypt(self, plaintext):
+        return self._run(plaintext, False)
+
+    def decrypt(self, ciphertext):
+        return self._run(ciphertext, True)
+
+    def _run(self, text, decrypting):
+        alphabet = self.alphabet
+        return alphabet.text(self.crypt_indices(bytearray(alphabet.indices(text)), decrypting))
+
+    def crypt_indices(self, ix, decrypting):
+        """Encrypt or decrypt the bytearray ix of letter indices in place, and return it."""
+        alphabet = self.alphabet
+        self.offset += len(ix)
+        if self.profile is not None:
+            return self._profiled(ix, decrypting)
+        size = alphabet.size
+        rows = alphabet.rows
+        cols = alphabet.cols
+        last = size - 1
+        corner = size * last
+        kaminsky = self.marker_mode == 1
+        b = self.board
+        pos = self.pos
+        (mr, mc) = self.mp
+        for (i, x) in enumerate(ix):
+            xp = pos[x]
+            mix = b[mr * size + mc]
+            if decrypting:
+                c = x
+                p = b[(rows[xp] - rows[mix]) % size * size + (cols[xp] - cols[mix]) % size]
+                ix[i] = p
+                pr = rows[pos[p]]
+            else:
+                c = b[(rows[xp] + rows[mix]) % size * size + (cols[xp] + cols[mix]) % size]
+                ix[i] = c
+                pr = rows[xp]
+
+            # rotate the plaintext row right
+            base = pr * size
+            t = b[base + last]
+            b[base + 1:base + size] = b[base:base + last]
+            b[base] = t
+            for j in range(base, base + size):
+                pos[b[j]] = j
+            if kaminsky and mr == pr: mc = (mc + 1) % size
+
+            # rotate the ciphertext column down
+            cc = cols[pos[c]]
+            t = b[corner + cc]
+            b[cc + size::size] = b[cc:corner:size]
+            b[cc] = t
+            for j in range(cc, corner + size, size):
+                pos[b[j]] = j
+            if kaminsky and mc == cc: mr = (mr + 1) % size
+
+            mr = (mr + rows[c]) % size
+            mc = (mc + cols[c]) % size
+        self.mp = (mr, mc)
+        return ix
+
+    def _profiled(self, ix, decrypting):
+        # the loop of crypt_indices(), with the same inlined operations,
+        # timing each phase
+        alphabet = self.alphabet
+        size = alphabet.size
+        rows = alphabet.rows
+        cols = alphabet.cols
+        last = size - 1
+        corner = size * last
+        kaminsky = self.marker_mode == 1
+        b = self.board
+        pos = self.pos
+        (mr, mc) = self.mp
+        t_pos = t_ix = t_right = t_down = t_marker = 0.0
+        start = timer()
+        for (i, x) in enumerate(ix):
+            t0 = timer()
+            xp = pos[x]
+            t1 = timer()
+            mix = b[mr * size + mc]
+            if decrypting:
+                c = x
+                p = b[(rows[xp] - rows[mix]) % size * size + (cols[xp] - cols[mix]) % size]
+                ix[i] = p
+                pr = rows[pos[p]]
+            else:
+                c = b[(rows[xp] + rows[mix]) % size * size + (cols[xp] + cols[mix]) % size]
+                ix[i] = c
+                pr = rows[xp]
+            t2 = timer()
+            base = pr * size
+            t = b[base + last]
+            b[base + 1:base + size] = b[base:base + last]
+            b[base] = t
+            for j in range(base, base + size):
+                pos[b[j]] = j
+            t3 = timer()
+            if kaminsky and mr == pr: mc = (mc + 1) % size
+            t4 = timer()
+            cc = cols[pos[c]]
+            t5 = timer()
+            t = b[corner + cc]
+            b[cc + size::size] = b[cc:corner:size]
+            b[cc] = t
+            for j in range(cc, corner + size, size):
+                pos[b[j]] = j
+            t6 = timer()
+            if kaminsky and mc == cc: mr = (mr + 1) % size
+            mr = (mr + rows[c]) % size
+            mc = (mc + cols[c]) % size
+            t7 = timer()
+            t_pos += (t1 - t0) + (t5 - t4)
+            t_ix += t2 - t1
+            t_right += t3 - t2
+            t_down += t6 - t5
+            t_marker += (t4 - t3) + (t7 - t6)
+        self.mp = (mr, mc)
+        profile = self.profile
+        profile.add('letters', timer() - start, len(ix))
+        profile.add('decrypt' if decrypting else 'encrypt', 0.0)
+        for (name, t) in zip(Profile.phases, (t_pos, t_ix, t_right, t_down, t_marker)):
+            profile.add(name, t, len(ix))
+        return ix
+
+
+class StreamEncryptor(object):
+    """
+    Incremental version of Cipher.encrypt_with_nonce(): feed the plaintext in
+    chunks to update(), then call final(). The nonce is processed first,
+    exactly as if the whole message was encrypted at once (with cache, the
+    state after it is kept for reuse, see Cipher.encrypt_prefix).
+    """
+
+    def __init__(self, cipher, key, nonce, cache=False):
+        self.nonce = nonce
+        self.state, self.nonce_enc = cipher.encrypt_prefix(key, nonce, cache)
+        self.head = nonce if cipher.nonce_mode==1 else self.nonce_enc
+
+    def update(self, plaintext):
+        head, self.head = self.head, ''
+        return head + self.state.encrypt(plaintext)
+
+    def final(self):
+        return self.update('')
+
+    def export(self):
+        return dict(state=self.state.export(), nonce=self.nonce, nonce_enc=self.nonce_enc, head=self.head)
+
+    @classmethod
+    def restore(cls, cipher, data):
+        """Recreate a StreamEncryptor exported by export(), e.g. for Checkpoint."""
+        s = cls.__new__(cls)
+        s.state = State.restore(data['state'], cipher.profile)
+        s.nonce = data['nonce']
+        s.nonce_enc = data['nonce_enc']
+        s.head = data['head']
+        return s
+
+
+class StreamDecryptor(object):
+    """
+    Incremental version of Cipher.decrypt_with_nonce(): the ciphertext chunks
+    are buffered until the whole nonce is available, and the nonce is
+    stripped from the output.
+    """
+
+    def __init__(self, cipher, key, nonce_size, cache=False):
+        cipher.check_key(key)
+        self.cipher = cipher
+        self.key = key
+        self.nonce_size = nonce_size
+        self.cache = cache
+        self.state = None
+        self.nonce = None
+        self.nonce_enc = None
+        self.head = ''
+
+    def update(self, ciphertext):
+        if self.state is not None:
+            return self.state.decrypt(ciphertext)
+        self.head += ciphertext
+        if len(self.head) < self.nonce_size:
+            return ''
+        return self._start()
+
+    def final(self):
+        if self.state is None:
+            return self._start()
+        return ''
+
+    def _start(self):
+        ciphertext, self.head = self.head, ''
+        n = self.nonce_size
+        self.nonce_enc = ciphertext[:n]
+        if self.cipher.nonce_mode==1:
+            self.nonce = ciphertext[:n]
+            self.state = self.cipher.encrypt_prefix(self.key, self.nonce, self.cache)[0]
+        else:
+            (self.state, self.nonce) = self.cipher.decrypt_prefix(self.key, ciphertext[:n], self.cache)
+        return self.state.decrypt(ciphertext[n:])
+
+    def export(self):
+        if self.state is None:
+            raise ValueError("Nothing to export before the nonce is complete")
+        return dict(state=self.state.export(), nonce=self.nonce, nonce_enc=self.nonce_enc,
+                    nonce_size=self.nonce_size)
+
+    @classmethod
+    def restore(cls, cipher, data):
+        """Recreate a StreamDecryptor exported by export(), e.g. for Checkpoint."""
+        s = cls.__new__(cls)
+        s.cipher = cipher
+        s.key = None
+        s.nonce_size = data['nonce_size']
+        s.cache = False
+        s.state = State.restore(data['state'], cipher.profile)
+        s.nonce = data['nonce']
+        s.nonce_enc = data['nonce_enc']
+        s.head = ''
+        return s
+
+
+class IndexedEncryptor(object):
+    """
+    StreamEncryptor s which also writes a random access index to the file f,
+    for decrypt_range(): a JSON header line, then one [offset, marker row,
+    marker column, board] line with the state before every `every`-th letter
+    of the ciphertext (the offsets count the nonce too). The index holds
+    running boards, so it is as secret as the key.
+    """
+
+    def __init__(self, s, f, every):
+        self.s = s
+        self.f = f
+        self.every = every
+        state = s.state
+        f.write(json.dumps(dict(letters=state.alphabet.letters, marker_mode=state.marker_mode,
+                                nonce_size=len(s.nonce), head=s.head, every=every)) + '\n')
+        self._snapshot()
+
+    @property
+    def nonce(self):
+        return self.s.nonce
+
+    @property
+    def nonce_enc(self):
+        return self.s.nonce_enc
+
+    def update(self, plaintext):
+        state = self.s.state
+        out = [self.s.update('')]
+        while plaintext:
+            n = self.every - state.offset % self.every
+            out.append(self.s.update(plaintext[:n]))
+            plaintext = plaintext[n:]
+            if state.offset % self.every == 0:
+                self._snapshot()
+        return ''.join(out)
+
+    def final(self):
+        self.f.flush()
+        return self.s.final()
+
+    def _snapshot(self):
+        state = self.s.state
+        self.f.write(json.dumps([state.offset, state.mp[0], state.mp[1], state.key]) + '\n')
+
+
+def read_index(f):
+    """
+    Read an index written by IndexedEncryptor: returns the header dict, with
+    the snapshot offsets in 'offsets' and the [offset, row, col, board] lines
+    in 'snapshots'.
+    """
+    index = json.loads(f.readline())
+    index['snapshots'] = [json.loads(line) for line in f if line.strip()]
+    index['offsets'] = [snap[0] for snap in index['snapshots']]
+    if not index['offsets'] or index['offsets'][0] != index['nonce_size']:
+        raise ValueError("Invalid index: no snapshot at the start of the message")
+    return index
+
+
+def decrypt_range(index, f, start, stop=None, profile=None):
+    """
+    Decrypt the letters start:stop of the plaintext (without the nonce) of
+    the ciphertext in the seekable file f, starting from the nearest
+    snapshot of the index (see read_index), so that only up to index['every']
+    letters before start are decrypted. No key is needed: the index has it.
+    """
+    if start < 0 or (stop is not None and stop < start):
+        raise ValueError("Invalid range %d:%s" % (start, stop))
+    head = index['head']
+    if f.read(len(head)) != head:
+        raise ValueError("The index does not belong to this ciphertext")
+    begin = index['nonce_size'] + start
+    i = bisect.bisect_right(index['offsets'], begin) - 1
+    (offset, mr, mc, board) = index['snapshots'][i]
+    state = State.restore(dict(letters=index['letters'], board=board, mp=(mr, mc), offset=offset,
+                               marker_mode=index['marker_mode']), profile)
+    f.seek(offset)
+    n = -1 if stop is None else index['nonce_size'] + stop - offset
+    ciphertext = f.read(n).rstrip('\r\n')
+    return state.decrypt(ciphertext)[begin - offset:]
+
+
+def create_random_nonce(size, letters):
+    return get_alphabet(letters).pool.take(size)
+
+
+class Cipher(object):
+    """
+    Configuration of the cipher: the alphabet (a 6x6 one gives LC4, 7x7 gives
+    LS47, optionally in the playing card variant; any other registered or
+    given square alphabet may be used instead, see register_alphabet), the
+    marker mode and the nonce mode (1 = Kaminsky, 2 = Kratochvil; by default
+    Kaminsky for LC4 and Kratochvil otherwise). The playing card alphabets
+    always derive keys one-indexed, however they were selected.
+
+    A Cipher holds no per-message state: every call works on its own State,
+    so one instance may be shared by many threads, and it can be pickled to
+    worker processes. Derived keys are memoized in key_cache, and states
+    after prefixes marked reusable in prefix_cache (by default the shared
+    default_key_cache and default_prefix_cache). If a Profile is given, the
+    cipher records its counters and timings there.
+    """
+
+    def __init__(self, size=6, playingcard=False, marker_mode=None, nonce_mode=None,
+                 key_cache=None, prefix_cache=None, profile=None, alphabet=None):
+        if alphabet is None:
+            alphabet = default_letters(size, playingcard)
+        self.alphabet = get_alphabet(named_alphabets.get(alphabet, alphabet))
+        self.size = size = self.alphabet.size
+        self.letters = self.alphabet.letters
+        if playingcard and self.letters not in card_alphabets:
+            raise ValueError("The playing card variant needs a playing card alphabet: '%s'" % self.letters)
+        self.playingcard = self.letters in card_alphabets
+        self.marker_mode = marker_mode or (1 if size==6 else 2)
+        self.nonce_mode = nonce_mode or (1 if size==6 else 2)
+        self.key_cache = key_cache or default_key_cache
+        self.prefix_cache = prefix_cache or default_prefix_cache
+        self.profile = profile
+
+    def __getstate__(self):
+        return (self.size, self.playingcard, self.marker_mode, self.nonce_mode, self.letters)
+
+    def __setstate__(self, config):
+        (size, playingcard, marker_mode, nonce_mode, letters) = config
+        self.__init__(size, playingcard, marker_mode, nonce_mode, alphabet=letters)
+
+    @property
+    def name(self):
+        if self.size == 6:
+            return "LC4"
+        if self.size == 7:
+            return "LS47"
+        return "LC4 %dx%d" % (self.size, self.size)
+
+    def derive_key(self, password, one_indexed=None):
+        """Generate the key from a keyword; one_indexed defaults to playingcard."""
+        if one_indexed is None:
+            one_indexed = self.playingcard
+        if self.profile is None:
+            return self.key_cache.derive_key(password, one_indexed, self.alphabet)
+        start = timer()
+        key = self.key_cache.derive_key(password, one_indexed, self.alphabet)
+        self.profile.add('derive_key', timer() - start)
+        return key
+
+    def check_key(self, key):
+        self._check(check_key, key)
+
+    def check_nonce(self, nonce):
+        self._check(check_nonce, nonce)
+
+    def check_plaintext(self, s):
+        self._check(check_plaintext, s)
+
+    def check_ciphertext(self, s):
+        self._check(check_ciphertext, s)
+
+    def _check(self, check, s):
+        if self.profile is None:
+            return check(s, self.alphabet)
+        start = timer()
+        try:
+            check(s, self.alphabet)
+        finally:
+            self.profile.add('validation', timer() - start, len(s))
+
+    def create_random_nonce(self, size):
+        return self.alphabet.pool.take(size)
+
+    def state(self, key):
+        self.check_key(key)
+        return State(key, self.alphabet, self.marker_mode, profile=self.profile)
+
+    def encrypt(self, key, plaintext):
+        return self.state(key).encrypt(plaintext)
+
+    def encrypt_prefix(self, key, prefix, cache=False):
+        """
+        Return the state after encrypting prefix with key, and the encrypted
+        prefix. With cache, for a prefix that will be used again (a common
+        header, or the nonce of a message that is retried or verified
+        again), a snapshot is kept in prefix_cache, so that the repeated
+        operations resume from there instead of processing the prefix again.
+        Fresh random nonces never repeat, so they are not cached by default:
+        that would only keep keys and boards in memory.
+        """
+        return self._prefix(key, prefix, True, cache)
+
+    def decrypt_prefix(self, key, prefix, cache=False):
+        """Same as encrypt_prefix(), for decryption."""
+        return self._prefix(key, prefix, False, cache)
+
+    def _prefix(self, key, prefix, encrypting, cache):
+        if not prefix or not cache:
+            state = self.state(key)
+            out = state.encrypt(prefix) if encrypting else state.decrypt(prefix)
+            return (state, out)
+        k = (encrypting, self.letters, self.marker_mode, key, prefix)
+        snapshot = self.prefix_cache.get(k)
+        if snapshot is None:
+            state = self.state(key)
+            out = state.encrypt(prefix) if encrypting else state.decrypt(prefix)
+            snapshot = (state.copy(), out)
+            self.prefix_cache.put(k, snapshot)
+        state = snapshot[0].copy()
+        state.profile = self.profile
+        return (state, snapshot[1])
+
+    def decrypt(self, key, ciphertext):
+        return self.state(key).decrypt(ciphertext)
+
+    def trial(self, key, ciphertext, known='', offset=0, nonce_size=0, allowed=None):
+        """
+        Check whether ciphertext (with a nonce of nonce_size letters)
+        decrypts with key to a plaintext containing known at offset (negative
+        offsets count from the end) and, if allowed is given, consisting only
+        of the letters in allowed. Only as much is decrypted as needed: the
+        check stops at the first mismatching or implausible letters.
+        """
+        n = nonce_size
+        body = ciphertext[n:]
+        if offset < 0:
+            offset += len(body)
+        end = offset + len(known)
+        if offset < 0 or end > len(body):
+            return False
+        state = self.state(key)
+        if self.nonce_mode==1:
+            state.encrypt(ciphertext[:n])
+        else:
+            state.decrypt(ciphertext[:n])
+
+        if allowed is None:
+            state.decrypt(body[:offset])
+            for (c, k) in zip(body[offset:end], known):
+                if state.decrypt(c) != k:
+                    return False
+            return True
+
+        # decrypt everything in growing blocks, checking each one
+        allowed = frozenset(allowed)
+        done = 0
+        step = 1
+        pieces = []
+        while done < len(body):
+            piece = state.decrypt(body[done:done + step])
+            if not allowed.issuperset(piece):
+                return False
+            if known and done < end:
+                pieces.append(piece)
+            done += len(piece)
+            step = min(2 * step, 256)
+            if known and done >= end and pieces:
+                if ''.join(pieces)[offset:end] != known:
+                    return False
+                pieces = []
+        return True
+
+    def encrypt_many(self, keys, plaintexts, backend='python'):
+        """
+        Encrypt a list of independent messages, each with its key (or all
+        with the same key). backend='numpy' runs them in lockstep, see
+        lockstep.py.
+        """
+        return self._crypt_many(keys, plaintexts, backend, True)
+
+    def decrypt_many(self, keys, ciphertexts, backend='python'):
+        return self._crypt_many(keys, ciphertexts, backend, False)
+
+    def _crypt_many(self, keys, texts, backend, encrypting):
+        if isinstance(keys, str):
+            keys = [keys] * len(texts)
+        if backend == 'numpy':
+            import lockstep
+            return lockstep.crypt_many(keys, texts, self.letters, self.marker_mode, not encrypting)
+        if backend != 'python':
+            raise ValueError("Unknown backend '%s'" % backend)
+        crypt = self.encrypt if encrypting else self.decrypt
+        return [crypt(k, t) for (k, t) in zip(keys, texts)]
+
+    def normalizer(self):
+        """A Normalizer mapping free text into the alphabet, see NormalizeTable."""
+        return Normalizer(self.alphabet)
+
+    def encryptor(self, key, nonce='', cache=False):
+        return StreamEncryptor(self, key, nonce, cache)
+
+    def decryptor(self, key, nonce_size=0, cache=False):
+        return StreamDecryptor(self, key, nonce_size, cache)
+
+    def encrypt_with_nonce(self, key, plaintext, nonce='', cache=False):
+        e = self.encryptor(key, nonce, cache)
+        return e.update(plaintext) + e.final()
+
+    def decrypt_with_nonce(self, key, ciphertext, nonce_size=0, cache=False):
+        d = self.decryptor(key, nonce_size, cache)
+        return d.update(ciphertext) + d.final()
+
+
+def binary_blocks(base):
+    """
+    Block layout for packing bytes into letters in the given base: (k, m, tails),
+    where blocks of k bytes (at most 32) become m letters with the best
+    letters per byte ratio, and tails[r] is the number of letters of a
+    final block of r bytes.
+    """
+    best = None
+    for k in range(1, 33):
+        m = 1
+        while base ** m < 256 ** k:
+            m += 1
+        if best is None or m * best[0] < best[1] * k:
+            best = (k, m)
+    (k, m) = best
+    tails = [0]
+    for r in range(1, k):
+        t = 1
+        while base ** t < 256 ** r:
+            t += 1
+        tails.append(t)
+    return (k, m, tails)
+
+
+class BinaryEncoder(object):
+    """
+    Streaming codec which packs arbitrary bytes into the letters of an
+    alphabet, so that binary payloads can be encrypted: each block of k bytes
+    is written as a big-endian number of m letters in base len(letters) (see
+    binary_blocks). A final partial block takes the fewest letters that can
+    hold it; as every extra byte needs at least one extra letter, the tail
+    length in letters tells the decoder the number of bytes.
+    """
+
+    def __init__(self, alphabet):
+        self.alphabet = alphabet
+        (self.k, self.m, self.tails) = binary_blocks(len(alphabet.letters))
+        self.rest = b''
+
+    def update(self, data):
+        data = self.rest + data
+        n = len(data) - len(data) % self.k
+        self.rest = data[n:]
+        return self._encode(data[:n])
+
+    def final(self):
+        (data, self.rest) = (self.rest, b'')
+        return self._encode(data)
+
+    def _encode(self, data):
+        base = len(self.alphabet.letters)
+        (k, m) = (self.k, self.m)
+        out = bytearray()
+        for i in range(0, len(data), k):
+            block = data[i:i + k]
+            width = m if len(block) == k else self.tails[len(block)]
+            n = int.from_bytes(block, 'big')
+            digits = bytearray(width)
+            for j in range(width - 1, -1, -1):
+                (n, digits[j]) = divmod(n, base)
+            out += digits
+        return self.alphabet.text(out)
+
+
+class BinaryDecoder(object):
+    """Inverse of BinaryEncoder; raises ValueError on malformed input."""
+
+    def __init__(self, alphabet):
+        self.alphabet = alphabet
+        (self.k, self.m, tails) = binary_blocks(len(alphabet.letters))
+        self.tails = dict((t, r) for (r, t) in enumerate(tails) if r)
+        self.rest = ''
+
+    def update(self, text):
+        text = self.rest + text
+        n = len(text) - len(text) % self.m
+        self.rest = text[n:]
+        return self._decode(text[:n])
+
+    def final(self):
+        (text, self.rest) = (self.rest, '')
+        if text and len(text) not in self.tails:
+            raise ValueError("Binary data truncated: %d stray letters at the end" % len(text))
+        return self._decode(text)
+
+    def _decode(self, text):
+        base = len(self.alphabet.letters)
+        ix = bytearray(self.alphabet.indices(text))
+        (k, m) = (self.k, self.m)
+        out = []
+        for i in range(0, len(ix), m):
+            block = ix[i:i + m]
+            size = k if len(block) == m else self.tails[len(block)]
+            n = 0
+            for d in block:
+                n = n * base + d
+            try:
+                out.append(n.to_bytes(size, 'big'))
+            except OverflowError:
+                raise ValueError("Invalid binary data block: '%s'" % text[i:i + m])
+        return b''.join(out)
+
+
+def stream_binary(s, check, alphabet, infile, outfile, chunk_size, encrypting, signature=''):
+    """
+    Like stream(), for --binary: when encrypting, the bytes of infile are
+    packed into letters by a BinaryEncoder before encryption (and followed
+    by the signature); when decrypting, the plaintext is unpacked to bytes
+    by a BinaryDecoder (s must strip any signature, see SignatureCheck).
+    """
+    if encrypting:
+        fin = open_input(infile, 'rb')
+        fout = open_output(outfile)
+        encoder = BinaryEncoder(alphabet)
+        chunks = iter(lambda: fin.read(chunk_size), b'')
+        convert = lambda text: text
+        finish = lambda: s.update(encoder.final() + signature) + s.final() + '\n'
     else:
-        return ciphertext
-
-
-def decrypt_with_nonce(ciphertext):
-    global nonce, nonce_enc
-
-    if nonce_mode==1:
-        nonce = ciphertext[:nonce_size]
-        nonce_enc = encrypt(nonce)
-        return decrypt(ciphertext[nonce_size:])
+        fin = open_input(infile)
+        fout = open_output(outfile, 'wb')
+        decoder = BinaryDecoder(alphabet)
+        chunks = read_chunks(fin, chunk_size)
+        convert = decoder.update
+        finish = lambda: decoder.update(s.final()) + decoder.final()
+    try:
+        for chunk in chunks:
+            if encrypting:
+                chunk = encoder.update(chunk)
+            else:
+                check(chunk)
+            fout.write(convert(s.update(chunk)))
+            fout.flush()
+        fout.write(finish())
+        fout.flush()
+    finally:
+        if fin not in (sys.stdin, sys.stdin.buffer): fin.close()
+        if fout not in (sys.stdout, sys.stdout.buffer): fout.close()
+
+
+def crypt_mmap(s, check, infile, outfile, chunk_size, encrypting, signature=''):
+    """
+    -ef/-df with --mmap: the input file is memory-mapped and processed as
+    bytes, chunk by chunk (validated and translated to letter indices with
+    the alphabet tables, run through the state of the StreamEncryptor/
+    StreamDecryptor s in place and translated back), into an output file of
+    the final size (with or without the nonce, and with the signature when
+    encrypting, plus the line end) which is memory-mapped too. So neither
+    file is held in memory, and the page cache does the I/O. check raises
+    ValueError for a chunk with letters not in the alphabet (only called
+    then, with the text of the chunk). On any error, the output file is
+    removed.
+    """
+    with open(infile, 'rb') as fin:
+        data = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(fin.fileno()).st_size else b''
+    try:
+        n = len(data)
+        while n and data[n - 1] in b'\r\n':
+            n -= 1
+        if encrypting:
+            (start, head) = (0, s.update('').encode('ascii'))
+            size = len(head) + n + len(signature)
+        else:
+            start = min(s.nonce_size, n)
+            head = s.update(data[:start].decode('ascii', 'replace')).encode('ascii')
+            if s.state is None:
+                head += s.final().encode('ascii')
+            size = n - start
+        fout = open(outfile, 'w+b')
+        try:
+            with fout:
+                fout.truncate(size + 1)
+                out = mmap.mmap(fout.fileno(), size + 1)
+            try:
+                out[:len(head)] = head
+                pos = len(head)
+                state = s.state
+                alphabet = state.alphabet
+                for i in range(start, n, chunk_size):
+                    chunk = data[i:min(i + chunk_size, n)]
+                    ix = bytearray(chunk.translate(alphabet.to_index))
+                    if 0xff in ix:
+                        check(chunk.decode('ascii', 'replace'))
+                    state.crypt_indices(ix, not encrypting)
+                    out[pos:pos + len(ix)] = ix.translate(alphabet.to_letter)
+                    pos += len(ix)
+                if signature:
+                    out[pos:pos + len(signature)] = s.update(signature).encode('ascii')
+                out[size:size + 1] = b'\n'
+                out.flush()
+            finally:
+                out.close()
+        except BaseException:
+            # not a full-size file, NUL-filled from where it failed
+            os.remove(outfile)
+            raise
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+
+
+def read_chunks(f, chunk_size):
+    """
+    Yield the contents of f in chunks of about chunk_size letters; the line
+    ending at the very end of the input is dropped (like rstrip('\\r\\n')).
+    """
+    tail = ''
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        chunk = tail + chunk
+        body = chunk.rstrip('\r\n')
+        tail = chunk[len(body):]
+        if body:
+            yield body
+
+
+def open_input(name, mode='r'):
+    if name == '-':
+        return sys.stdin.buffer if 'b' in mode else sys.stdin
+    return open(name, mode)
+
+
+def open_output(name, mode='w'):
+    if name == '-':
+        return sys.stdout.buffer if 'b' in mode else sys.stdout
+    return open(name, mode)
+
+
+class Checkpoint(object):
+    """
+    Progress of a stream() job, saved to path every `every` letters: the
+    job (cipher configuration, files, signature), the exported stream state
+    and the input and output positions it belongs to. The file is replaced
+    atomically and removed when the job is done. It holds the running board,
+    which decrypts the rest of the message, so it is only readable by the
+    owner.
+
+    Checkpoint.load(path) returns the saved checkpoint of an interrupted job,
+    whose open() continues both files from the saved positions.
+    """
+
+    def __init__(self, path, every, cipher, encrypting, infile, outfile, chunk_size, signature=''):
+        if infile == '-' or outfile == '-':
+            raise ValueError("Checkpoints need named input and output files")
+        self.path = path
+        self.every = every
+        self.cipher = cipher
+        self.job = dict(encrypting=encrypting, infile=os.path.abspath(infile),
+                        outfile=os.path.abspath(outfile), chunk_size=chunk_size, signature=signature,
+                        letters=cipher.letters, playingcard=cipher.playingcard,
+                        marker_mode=cipher.marker_mode, nonce_mode=cipher.nonce_mode, every=every)
+        self.data = None
+        self.input = 0
+        self.last = 0
+
+    @staticmethod
+    def load(path, profile=None):
+        with open(path, 'r') as f:
+            data = json.load(f)
+        job = data['job']
+        cipher = Cipher(alphabet=job['letters'], playingcard=job['playingcard'], marker_mode=job['marker_mode'],
+                        nonce_mode=job['nonce_mode'], profile=profile)
+        checkpoint = Checkpoint(path, job['every'], cipher, job['encrypting'], job['infile'], job['outfile'],
+                                job['chunk_size'], job['signature'])
+        checkpoint.data = data
+        checkpoint.input = checkpoint.last = data['input']
+        return checkpoint
+
+    def stream(self):
+        """The StreamEncryptor/StreamDecryptor as of the checkpoint."""
+        cls = StreamEncryptor if self.job['encrypting'] else StreamDecryptor
+        return cls.restore(self.cipher, self.data['stream'])
+
+    def open(self):
+        job = self.job
+        if self.data is None:
+            return (open(job['infile'], 'r'), open(job['outfile'], 'w'))
+        fin = open(job['infile'], 'r')
+        fin.seek(self.data['input'])
+        fout = open(job['outfile'], 'r+')
+        fout.seek(self.data['output'])
+        fout.truncate()
+        return (fin, fout)
+
+    def update(self, s, letters, fout):
+        self.input += letters
+        if self.input - self.last < self.every or s.state is None:
+            return
+        fout.flush()
+        os.fsync(fout.fileno())
+        data = dict(job=self.job, stream=s.export(), input=self.input, output=fout.tell())
+        tmp = self.path + '.tmp'
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self.last = self.input
+
+    def done(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def stream(s, check, infile, outfile, chunk_size, signature='', checkpoint=None):
+    """
+    Run the file infile through the StreamEncryptor/StreamDecryptor s chunk
+    by chunk, in bounded memory, writing the result to outfile. Each chunk
+    is validated by check. With a Checkpoint, the files are those of the
+    checkpoint, and the progress is saved as it goes.
+    """
+    if checkpoint is None:
+        fin = open_input(infile)
+        fout = open_output(outfile)
     else:
-        plaintext = decrypt(ciphertext)
-        nonce = plaintext[:nonce_size]
-        nonce_enc = ciphertext[:nonce_size]
-        return plaintext[nonce_size:]
+        (fin, fout) = checkpoint.open()
+    try:
+        for chunk in read_chunks(fin, chunk_size):
+            check(chunk)
+            fout.write(s.update(chunk))
+            fout.flush()
+            if checkpoint is not None:
+                checkpoint.update(s, len(chunk), fout)
+        if signature:
+            fout.write(s.update(signature))
+        fout.write(s.final() + '\n')
+        fout.flush()
+        if checkpoint is not None:
+            checkpoint.done()
+    finally:
+        if fin is not sys.stdin: fin.close()
+        if fout is not sys.stdout: fout.close()
+
+
+def read_batch(path):
+    """
+    Yield the messages of a batch as dicts with 'id' and 'text' (and
+    optionally 'nonce'): path is either a JSONL file (- for stdin) with one
+    such object per line, or a directory with one message per file.
+    """
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            full = os.path.join(path, name)
+            if not os.path.isfile(full):
+                continue
+            try:
+                with open(full, 'r') as f:
+                    msg = dict(id=name, text=f.read().rstrip('\r\n'))
+            except (IOError, UnicodeError) as e:
+                msg = dict(id=name, error="%s: %s" % (name, e))
+            yield msg
+        return
+    f = open_input(path)
+    try:
+        for (n, line) in enumerate(f):
+            if not line.strip():
+                continue
+            try:
+                msg = json.loads(line)
+                if not isinstance(msg, dict) or not isinstance(msg.get('text'), str):
+                    raise ValueError("expected an object with a 'text' string")
+                if not isinstance(msg.get('nonce', ''), str):
+                    raise ValueError("the 'nonce' must be a string")
+            except ValueError as e:
+                msg = dict(error="Line %d: %s" % (n + 1, e))
+            msg.setdefault('id', n + 1)
+            yield msg
+    finally:
+        if f is not sys.stdin: f.close()
+
+
+class BatchJob(object):
+    """
+    Picklable worker of batch(): encrypts or decrypts one message, reporting
+    invalid input in the result instead of raising. The signature is
+    appended when encrypting; when decrypting, the result tells whether the
+    plaintext ends with it ('signature': true/false).
+    """
+
+    def __init__(self, cipher, key, encrypting, nonce_size=0, signature=''):
+        self.cipher = cipher
+        self.key = key
+        self.encrypting = encrypting
+        self.nonce_size = nonce_size
+        self.signature = signature or ''
+
+    def __call__(self, msg):
+        if 'error' in msg:
+            return dict(id=msg['id'], error=msg['error'])
+        cipher = self.cipher
+        try:
+            if self.encrypting:
+                nonce = msg.get('nonce', '')
+                cipher.check_nonce(nonce)
+                plaintext = msg['text'] + self.signature
+                cipher.check_plaintext(plaintext)
+                return dict(id=msg['id'], nonce=nonce,
+                            text=cipher.encrypt_with_nonce(self.key, plaintext, nonce))
+            else:
+                cipher.check_ciphertext(msg['text'])
+                plaintext = cipher.decrypt_with_nonce(self.key, msg['text'], self.nonce_size)
+                result = dict(id=msg['id'], text=plaintext)
+                if self.signature:
+                    result['signature'] = plaintext.endswith(self.signature)
+                return result
+        except ValueError as e:
+            return dict(id=msg['id'], error=str(e))
+
+
+class ChunkJob(object):
+    """Picklable worker of batch(): runs job over a list of messages."""
+
+    def __init__(self, job):
+        self.job = job
+
+    def __call__(self, messages):
+        return [self.job(msg) for msg in messages]
+
+
+def batch(job, messages, jobs=None, chunksize=64):
+    """
+    Run job over the messages on a pool of jobs processes (default: one per
+    CPU), yielding the results in input order. The messages are sent in
+    chunks, with a bounded number in flight (see pipeline), so that they
+    are read only as fast as they are processed.
+    """
+    if jobs == 1:
+        for msg in messages:
+            yield job(msg)
+        return
+    messages = iter(messages)
+    chunks = iter(lambda: list(itertools.islice(messages, chunksize)), [])
+    for results in pipeline(ChunkJob(job), chunks, jobs):
+        for result in results:
+            yield result
+
+
+def pipeline(job, items, jobs=None, window=None):
+    """
+    Like batch(), but with at most window items (default: 4 per process) in
+    flight, so that items is consumed only as fast as the results are.
+    """
+    if jobs == 1:
+        for item in items:
+            yield job(item)
+        return
+    pool = multiprocessing.Pool(jobs)
+    window = window or 4 * (jobs or multiprocessing.cpu_count())
+    pending = collections.deque()
+    try:
+        for item in items:
+            pending.append(pool.apply_async(job, (item,)))
+            if len(pending) >= window:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+
+
+class ContainerJob(object):
+    """
+    Picklable worker of the container functions: encrypts an (index, nonce,
+    plaintext) chunk to (index, length, ciphertext), or decrypts an (index,
+    nonce size, ciphertext) chunk to (index, plaintext).
+    """
+
+    def __init__(self, cipher, key, encrypting):
+        self.cipher = cipher
+        self.key = key
+        self.encrypting = encrypting
+
+    def __call__(self, chunk):
+        (i, nonce, text) = chunk
+        if self.encrypting:
+            return (i, len(text), self.cipher.encrypt_with_nonce(self.key, text, nonce))
+        return (i, self.cipher.decrypt_with_nonce(self.key, text, nonce))
+
+
+def encrypt_container(cipher, key, fin, fout, chunk_size, nonce_size, jobs=None, signature=''):
+    """
+    Encrypt the file fin in chunks of about chunk_size letters, each one a
+    separate message with a fresh random nonce, on a pool of jobs processes,
+    and write the container to fout:
+
+        LC4C <nonce size>
+        <chunk index> <plaintext length>
+        <ciphertext, starting with the nonce>
+        ...
+        END <number of chunks>
+
+    so that every chunk can also be decrypted on its own. The signature is
+    appended to the last chunk.
+    """
+    if nonce_size <= 0:
+        raise ValueError("Every chunk of a container needs its own nonce")
+    cipher.check_key(key)
+
+    def chunks():
+        last = ''
+        i = 0
+        for chunk in read_chunks(fin, chunk_size):
+            cipher.check_plaintext(chunk)
+            if last:
+                yield (i, cipher.create_random_nonce(nonce_size), last)
+                i += 1
+            last = chunk
+        last += signature
+        cipher.check_plaintext(last)
+        yield (i, cipher.create_random_nonce(nonce_size), last)
+
+    fout.write('LC4C %d\n' % nonce_size)
+    n = 0
+    for (i, length, ciphertext) in pipeline(ContainerJob(cipher, key, True), chunks(), jobs):
+        fout.write('%d %d\n%s\n' % (i, length, ciphertext))
+        n += 1
+    fout.write('END %d\n' % n)
+    fout.flush()
+
+
+def read_container(f):
+    """
+    Yield the (index, nonce size, ciphertext) chunks of a container written
+    by encrypt_container, checking that none is missing, reordered or cut.
+    """
+    header = f.readline().split()
+    if len(header) != 2 or header[0] != 'LC4C':
+        raise ValueError("Not a container")
+    nonce_size = int(header[1])
+    i = 0
+    while True:
+        line = f.readline().split()
+        if not line:
+            raise ValueError("Container ends after %d chunks without END" % i)
+        if len(line) == 2 and line[0] == 'END':
+            if int(line[1]) != i:
+                raise ValueError("Container ends after %d of %s chunks" % (i, line[1]))
+            return
+        if len(line) != 2 or int(line[0]) != i:
+            raise ValueError("Container chunk %d is missing" % i)
+        n = nonce_size + int(line[1])
+        ciphertext = f.read(n)
+        if len(ciphertext) != n or f.read(1) != '\n':
+            raise ValueError("Container chunk %d is truncated" % i)
+        yield (i, nonce_size, ciphertext)
+        i += 1
+
+
+def decrypt_container(cipher, key, fin, fout, jobs=None, check=None):
+    """
+    Decrypt a container (see encrypt_container) from fin, writing the
+    plaintext to fout, through the SignatureCheck check if given.
+    """
+    cipher.check_key(key)
+    check = check or (lambda text: text)
+
+    def chunks():
+        for (i, nonce_size, ciphertext) in read_container(fin):
+            cipher.check_ciphertext(ciphertext)
+            yield (i, nonce_size, ciphertext)
+
+    for (i, plaintext) in pipeline(ContainerJob(cipher, key, False), chunks(), jobs):
+        fout.write(check(plaintext))
+    fout.write('\n')
+    fout.flush()
+
+
+# Keyring files: a header (magic, number of records, record size), then
+# records sorted by (configuration, id): the configuration digest (see
+# keyring_config), the key id, a digest of the keyword and the key, each
+# NUL-padded to its fixed size.
+keyring_magic = b'LC4KEYS1'
+keyring_header = struct.Struct('<8sII')
+keyring_record = struct.Struct('<8s64s16s128s')
+
+
+def keyring_config(alphabet, one_indexed=False):
+    """Digest of the configuration (alphabet and derive_key numbering) a keyring key belongs to."""
+    return hashlib.sha256(('%s\0%d' % (alphabet.letters, bool(one_indexed))).encode('ascii')).digest()[:8]
+
+
+def keyword_digest(keyword):
+    return hashlib.sha256(keyword.encode('utf-8')).digest()[:16]
+
+
+def is_keyring(path):
+    with open(path, 'rb') as f:
+        return f.read(len(keyring_magic)) == keyring_magic
+
+
+class Keyring(collections.abc.Mapping):
+    """
+    Read-only mapping of key ids to keys, for one configuration, of a keyring
+    file (see update_keyring). The file is memory-mapped and the fixed-size
+    records are found by binary search, so a new process looks keys up
+    without parsing the file or deriving anything. It can be passed to
+    Router like any other keyring.
+    """
+
+    def __init__(self, path, alphabet, one_indexed=False):
+        self.config = keyring_config(alphabet, one_indexed)
+        with open(path, 'rb') as f:
+            header = f.read(keyring_header.size)
+            if len(header) < keyring_header.size:
+                raise ValueError("Not a keyring file: %s" % path)
+            (magic, self.count, size) = keyring_header.unpack(header)
+            if magic != keyring_magic or size != keyring_record.size:
+                raise ValueError("Not a keyring file: %s" % path)
+            if os.fstat(f.fileno()).st_size < keyring_header.size + self.count * size:
+                raise ValueError("Truncated keyring file: %s" % path)
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.start = self._search(self.config)
+        self.stop = self._search(self.config + b'\xff')
+
+    def _prefix(self, i):
+        # the sort key of record i: the configuration and the padded id
+        offset = keyring_header.size + i * keyring_record.size
+        return self.map[offset:offset + 72]
+
+    def _search(self, prefix):
+        (lo, hi) = (0, self.count)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._prefix(mid) < prefix:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _record(self, i):
+        offset = keyring_header.size + i * keyring_record.size
+        return keyring_record.unpack_from(self.map, offset)
+
+    def __getitem__(self, id):
+        raw = id.encode('utf-8')
+        if len(raw) > 64:
+            raise KeyError(id)
+        i = self._search(self.config + raw)
+        if i < self.stop:
+            (config, rid, digest, key) = self._record(i)
+            if rid.rstrip(b'\0') == raw:
+                return key.rstrip(b'\0').decode('ascii')
+        raise KeyError(id)
+
+    def __iter__(self):
+        for i in range(self.start, self.stop):
+            yield self._record(i)[1].rstrip(b'\0').decode('utf-8')
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def close(self):
+        self.map.close()
+
+
+def read_keyring(path):
+    """All records of a keyring file, as (config, id, keyword digest, key) tuples of bytes."""
+    if not os.path.exists(path):
+        return []
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < keyring_header.size:
+        raise ValueError("Not a keyring file: %s" % path)
+    (magic, count, size) = keyring_header.unpack_from(data)
+    if magic != keyring_magic or size != keyring_record.size:
+        raise ValueError("Not a keyring file: %s" % path)
+    if len(data) < keyring_header.size + count * size:
+        raise ValueError("Truncated keyring file: %s" % path)
+    return [keyring_record.unpack_from(data, keyring_header.size + i * size) for i in range(count)]
+
+
+def update_keyring(path, cipher, keywords, remove=()):
+    """
+    Add the keys derived from keywords (a mapping of key ids to keywords)
+    for the cipher configuration to the keyring file path, creating it if
+    needed, then drop the ids in remove. Keys whose keyword did not change
+    are not derived again. The file is rewritten atomically, readable only
+    by the owner. Returns the numbers of (added, changed, unchanged,
+    removed) keys.
+    """
+    config = keyring_config(cipher.alphabet, cipher.playingcard)
+    records = dict(((r[0], r[1]), r) for r in read_keyring(path))
+    counts = collections.Counter()
+    for (id, keyword) in keywords.items():
+        raw = id.encode('utf-8')
+        if len(raw) > 64 or b'\0' in raw:
+            raise ValueError("Key id too long or invalid: %r" % id)
+        k = (config, raw.ljust(64, b'\0'))
+        digest = keyword_digest(keyword)
+        old = records.get(k)
+        if old is not None and old[2] == digest:
+            counts['unchanged'] += 1
+            continue
+        key = derive_key(keyword, cipher.playingcard, cipher.alphabet)
+        check_key(key, cipher.alphabet)
+        records[k] = (config, k[1], digest, key.encode('ascii'))
+        counts['changed' if old else 'added'] += 1
+    for id in remove:
+        if records.pop((config, id.encode('utf-8').ljust(64, b'\0')), None):
+            counts['removed'] += 1
+    tmp = path + '.tmp'
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(keyring_header.pack(keyring_magic, len(records), keyring_record.size))
+        for k in sorted(records):
+            f.write(keyring_record.pack(*records[k]))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return tuple(counts[n] for n in ('added', 'changed', 'unchanged', 'removed'))
+
+
+class RouteJob(object):
+    """Picklable worker of Router: the ids of the (id, key) pairs that pass the trial."""
+
+    def __init__(self, cipher, ciphertext, known, offset, nonce_size, allowed):
+        self.cipher = cipher
+        self.args = (ciphertext, known, offset, nonce_size, allowed)
+
+    def __call__(self, keys):
+        return [i for (i, key) in keys if self.cipher.trial(key, *self.args)]
+
+
+class Router(object):
+    """
+    Finds which keys of a keyring (a mapping of key ids to keys) an inbound
+    message may have been encrypted with, by trial decryption with every key
+    which stops as soon as the plaintext fails the plausibility check (only
+    letters from allowed) or does not contain the known part (e.g. the
+    signature, with offset=-len(signature)). The keys are split among jobs
+    worker processes.
+    """
+
+    def __init__(self, cipher, keyring, nonce_size=0, known='', offset=0, allowed=None, jobs=1):
+        if not known and allowed is None:
+            raise ValueError("Routing needs a known part of the plaintext or a set of allowed letters")
+        self.cipher = cipher
+        self.keys = list(keyring.items())
+        self.nonce_size = nonce_size
+        self.known = known
+        self.offset = offset
+        self.allowed = allowed and ''.join(sorted(set(allowed)))
+        self.jobs = jobs or multiprocessing.cpu_count()
+        self.pool = multiprocessing.Pool(self.jobs) if self.jobs > 1 else None
+
+    def route(self, ciphertext):
+        """Return the ids of all keys that pass the trial, in keyring order."""
+        job = RouteJob(self.cipher, ciphertext, self.known, self.offset, self.nonce_size, self.allowed)
+        if self.pool is None:
+            return job(self.keys)
+        n = -(-len(self.keys) // (4 * self.jobs))
+        parts = [self.keys[i:i + n] for i in range(0, len(self.keys), n)]
+        return [i for ids in self.pool.map(job, parts) for i in ids]
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
 
 
 def eprint(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
 
 
-def printinfo(enc=False):  # used by test1() and when option -v
-    eprint('CIPHER    : ' + ("LC4" if size==6 else "LS47"))
-    eprint('ALPHABET  : ' + letters)
-    if szkeyword:
-        eprint('KEYWORD   : ' + szkeyword)
-    eprint('KEY       : ' + initialkey)  # key variable modified during process?
-    eprint('NONCE     : ' + nonce)
-    eprint('NONCE ENC : ' + nonce_enc)
-    eprint('NONCEMODE : ' + ("Kaminsky" if nonce_mode==1 else "Kratochvil"))
-    eprint('MARKER    : ' + ("Kaminsky" if marker_mode==1 else "Kratochvil"))
+def count_type(minimum):
+    """argparse type of the size and count options: an integer >= minimum."""
+    def convert(value):
+        try:
+            n = int(value)
+        except ValueError:
+            n = None
+        if n is None or n < minimum:
+            raise argparse.ArgumentTypeError('must be an integer >= %d: %r' % (minimum, value))
+        return n
+    return convert
+
+
+positive = count_type(1)
+non_negative = count_type(0)
+
+
+def printinfo(cipher, info, enc=False, texts=True):  # used by test1() and when option -v
+    eprint('CIPHER    : ' + cipher.name)
+    eprint('ALPHABET  : ' + cipher.letters)
+    if info.get('keyword'):
+        eprint('KEYWORD   : ' + info['keyword'])
+    eprint('KEY       : ' + info['key'])
+    eprint('NONCE     : ' + info['nonce'])
+    eprint('NONCE ENC : ' + info['nonce_enc'])
+    eprint('NONCEMODE : ' + ("Kaminsky" if cipher.nonce_mode==1 else "Kratochvil"))
+    eprint('MARKER    : ' + ("Kaminsky" if cipher.marker_mode==1 else "Kratochvil"))
+    if not texts:
+        return
     if enc:
-        # if args.signature: print ("args.SIGNA:", args.signature)
-        if szsignature: print ("SIGNATURE: ", szsignature)
-        eprint('PLAINTEXT : ' + plaintext)
-        eprint('CIPHERTEXT: ' + ciphertext)
+        if info.get('signature'): print ("SIGNATURE: ", info['signature'])
+        eprint('PLAINTEXT : ' + info['plaintext'])
+        eprint('CIPHERTEXT: ' + info['ciphertext'])
     else:
-        eprint('CIPHERTEXT: ' + ciphertext)
-        eprint('PLAINTEXT : ' + plaintext)
+        eprint('CIPHERTEXT: ' + info['ciphertext'])
+        eprint('PLAINTEXT : ' + info['plaintext'])
 
 
-def test1(size, fixednonce):
-    # Declaration "global" only needed if you like to write to a global variable
-    # [here, this is necessary only if the global var. is used within a fct. called by test1()]
-    # As test1() is called several times don't change args components within this fct.
-    global letters, nonce_mode, marker_mode, tiles, noncelen, nonce, nonce_size, nonce_enc
-    global ciphertext, plaintext, key, initialkey, mp
-    global szkeyword, szsignature
-
+def test1(size, fixednonce, keyword=None, signature=''):
     if size == 7:
-        CIPHERNAME = "LS47"
-        letters = letters7
-        nonce_mode = 2
-        marker_mode = 2
+        cipher = Cipher(7, marker_mode=2, nonce_mode=2)
         if fixednonce == 0:
-            noncelen=10; nonce = create_random_nonce(noncelen)
+            nonce = cipher.create_random_nonce(10)
         else:
             nonce = 'dr0+:_pij2'  # just a sample for testing fixed nonce
     else:
-        CIPHERNAME = "LC4"
-        letters = letters6
-        nonce_mode = 1
-        marker_mode = 1
+        cipher = Cipher(6, marker_mode=1, nonce_mode=1)
         if fixednonce == 0:
-            noncelen=6; nonce = create_random_nonce(noncelen)
+            nonce = cipher.create_random_nonce(6)
         else:
             nonce = 'pjpm5i'  # just a sample for testing fixed nonce
 
-    tiles = list(zip(letters, [(x // size, x % size) for x in range(size * size)]))
-    check_nonce(nonce)
-    nonce_size = len(nonce)
-    nonce_enc = ""
+    cipher.check_nonce(nonce)
 
-    print('\n' + CIPHERNAME)
+    print('\n' + cipher.name)
 
     if size == 7:
-        if args.keywordstring:
-            keyword = args.keywordstring  # Allows to use -ws besides -t
-        else:
+        if not keyword:
             keyword = 's3cret_p4ssw0rd/31337'
-        szkeyword = keyword # This statement needed to show keyword in printinfo() [don't change args.keywordstring within test1()!]
-        key = derive_key(keyword, false)
+        key = cipher.derive_key(keyword, False)
     else:
-        key = letters
-    initialkey = key
-    check_key(key)
-    mp = (0, 0)
+        keyword = ''
+        key = cipher.letters
+    cipher.check_key(key)
 
     if size == 7:
         # signature = 'peace-vector-3'   # just to name a meaningful value for size=7
         plaintext = 'conflagrate_the_rose_bush_at_six!'
-        if szsignature: plaintext += szsignature
     else:
         # signature = '#its_me'  # Notice: with size=6 the chars "#", "0", "1", "-" aren't part of the alphabet
         plaintext = 'its_my_fathers_son_but_not_my_brother'
-        if szsignature: plaintext += szsignature
+    if signature: plaintext += signature
 
-    check_plaintext(plaintext)
-    ciphertext = encrypt_with_nonce(plaintext)
+    cipher.check_plaintext(plaintext)
+    e = cipher.encryptor(key, nonce)
+    ciphertext = e.update(plaintext) + e.final()
 
-    key = initialkey; mp = (0, 0)  # initialization again
-    check_ciphertext(ciphertext)
-    decryptedtext = decrypt_with_nonce(ciphertext)
+    cipher.check_ciphertext(ciphertext)
+    decryptedtext = cipher.decrypt_with_nonce(key, ciphertext, len(nonce))
     print('decrypted text: ' + decryptedtext)
 
-    printinfo(True) # Called from test1() with arg TRUE = assume to do decryption
-
-    szkeyword=''
+    printinfo(cipher, dict(keyword=keyword, key=key, nonce=nonce, nonce_enc=e.nonce_enc,
+                           signature=signature, plaintext=plaintext, ciphertext=ciphertext),
+              True) # Called from test1() with arg TRUE = assume to do decryption
 
 
 
@@ -338,22 +2011,27 @@ if __name__ == '__main__':
     mgroup1.add_argument("-7", "--ls47", help="use LS47 cipher (7x7 table)", action="store_true")
 
     parser.add_argument("-pc", "--playingcard", help="Use the \"playing card\" character tables (default: standard tables)", action="store_true")
+    parser.add_argument("-a", "--alphabet", metavar="NAME", help="use the alphabet NAME (%s) or the given size*size letters as the board, instead of -6/-7/-pc" % ', '.join(sorted(named_alphabets)))
 
     mgroup2 = parser.add_mutually_exclusive_group()
     mgroup2.add_argument("-ks", "--keystring", metavar="STRING", help="use STRING as key")
     mgroup2.add_argument("-kf", "--keyfile", metavar="FILE", help="read key from FILE")
     mgroup2.add_argument("-ws", "--keywordstring", metavar="STRING", help="generate key from keyword STRING", default=None)
     mgroup2.add_argument("-wf", "--keywordfile", metavar="FILE", help="read keyword from FILE to generate key", default=None)
+    mgroup2.add_argument("-ki", "--keyid", metavar="ID", help="use the key ID of the --keyring FILE")
+    parser.add_argument("--keyring", metavar="FILE", help="keyring file built by lc4keyring.py, for -ki")
 
     mgroup4 = parser.add_mutually_exclusive_group()
     mgroup4.add_argument("-es", "--encryptstring", metavar="STRING", help="encrypt STRING")
     mgroup4.add_argument("-ef", "--encryptfile", metavar="FILE", help="read plaintext from FILE and encrypt it")
     mgroup4.add_argument("-ds", "--decryptstring", metavar="STRING", help="decrypt STRING")
     mgroup4.add_argument("-df", "--decryptfile", metavar="FILE", help="read ciphertext from FILE and decrypt it")
+    mgroup4.add_argument("-eb", "--encryptbatch", metavar="PATH", help="encrypt a batch of messages: a JSONL FILE with {\"id\": ..., \"text\": ...} lines, or a DIRECTORY with one message per file; writes JSONL results")
+    mgroup4.add_argument("-db", "--decryptbatch", metavar="PATH", help="decrypt a batch of messages, like -eb")
     mgroup4.add_argument("-t", "--test", help="encrypt and decrypt a string with a given key (with LC4, the given key equals the alphabet). Four cases tested: random/fixed nonce, each with LC4 and LS47", action="store_true")
 
     mgroup3 = parser.add_mutually_exclusive_group()
-    mgroup3.add_argument("-nl", "--noncelen", metavar="LENGTH", help="use random nonce of length LENGTH (default: no nonce)", type=int, default=0)
+    mgroup3.add_argument("-nl", "--noncelen", metavar="LENGTH", help="use random nonce of length LENGTH (default: no nonce)", type=non_negative, default=0)
     mgroup3.add_argument("-ns", "--noncestring", metavar="STRING", help="use STRING as nonce (default: no nonce)")
 
     mgroup5 = parser.add_mutually_exclusive_group()
@@ -365,7 +2043,26 @@ if __name__ == '__main__':
     mgroup6.add_argument("-m1", "--mKratochvil", help="use marker in Kratochvil mode (default for LS47)", action="store_true")
 
 
-    parser.add_argument("-s", "--signature", help="append SIGNATURE to plaintext when encrypting (default: no signature)")
+    parser.add_argument("-s", "--signature", help="append SIGNATURE to plaintext when encrypting; when decrypting, check that the plaintext ends with SIGNATURE (exit status 3 if not; with --binary, it is also removed) (default: no signature)")
+    parser.add_argument("--normalize", help="map free text into the alphabet before encrypting (-es/-ef, also with --stream): other case, no accents, whitespace as _; other characters are dropped (-v reports how many were altered)", action="store_true")
+
+    parser.add_argument("--route", metavar="FILE", help="find which keys of the keyring FILE (JSON {\"id\": \"key\", ...}, or built by lc4keyring.py) decrypt the -ds/-df message to a plaintext ending with the -s SIGNATURE and/or consisting of the --plausible letters; prints the matching ids")
+    parser.add_argument("--plausible", metavar="LETTERS", help="letters that may occur in the plaintext, for --route")
+    parser.add_argument("--stream", help="process the -ef/-df FILE in chunks, in bounded memory, writing the output as it goes (use - for stdin)", action="store_true")
+    parser.add_argument("--binary", help="with -ef, encrypt the FILE as arbitrary bytes, packed into the alphabet; with -df, unpack the plaintext back to bytes (implies --stream)", action="store_true")
+    parser.add_argument("--mmap", help="memory-map the -ef/-df FILE and the -o output FILE instead of reading and writing them, for very large files", action="store_true")
+    parser.add_argument("--container", help="with -ef, encrypt the FILE as a container of separately encrypted chunks of --chunk-size letters, each with a fresh -nl nonce, on -j processes; with -df, decrypt such a container", action="store_true")
+    parser.add_argument("--chunk-size", metavar="N", help="read N letters at once in --stream mode, or per --container chunk (default: 65536)", type=positive, default=65536)
+    parser.add_argument("--checkpoint", metavar="FILE", help="in --stream mode with -o FILE, save the progress to FILE (removed when done), so that an interrupted job can be continued with --resume")
+    parser.add_argument("--checkpoint-every", metavar="N", help="save a --checkpoint every N letters (default: 10000000)", type=positive, default=10000000)
+    parser.add_argument("--index", metavar="FILE", help="with -ef, also write a random access index to FILE (implies --stream; the index is as secret as the key); with -df, use it to decrypt just the --range")
+    parser.add_argument("--index-every", metavar="N", help="store a state in the --index every N letters (default: 65536)", type=positive, default=65536)
+    parser.add_argument("--range", metavar="START:STOP", help="with -df and --index, only decrypt the plaintext letters START to STOP (excluded; counted without the nonce; STOP may be omitted)")
+    parser.add_argument("--resume", metavar="FILE", help="continue the interrupted --stream job saved in the checkpoint FILE (no other options needed)")
+    parser.add_argument("-o", "--output", metavar="FILE", help="write the --stream or batch output to FILE (default: - for stdout)", default="-")
+    parser.add_argument("--profile", metavar="FILE", help="write profiling information to FILE on exit (in-process work only; use -j 1 with batches)")
+    parser.add_argument("--profile-format", help="write the --profile counters and phase timings as JSON (default), or a cProfile dump", choices=["json", "cprofile"], default="json")
+    parser.add_argument("-j", "--jobs", metavar="N", help="number of worker processes for batches (default: number of CPUs)", type=positive, default=None)
 
     args = parser.parse_args()
 
@@ -377,117 +2074,319 @@ if __name__ == '__main__':
         # parser.print_help()
         sys.exit(1)
 
+    if args.resume:
+        checkpoint = Checkpoint.load(args.resume)
+        job = checkpoint.job
+        s = checkpoint.stream()
+        cipher = checkpoint.cipher
+        check = cipher.check_plaintext if job['encrypting'] else cipher.check_ciphertext
+        stream(s, check, job['infile'], job['outfile'], job['chunk_size'], job['signature'], checkpoint)
+        sys.exit(0)
+
     # set cipher
 
-    if args.ls47:
-        size = 7
-        if args.playingcard:
-            letters = letters7card
-        else:
-            letters = letters7
-    else:
-        size = 6
-        if args.playingcard:
-            letters = letters6card
-        else:
-            letters = letters6
+    nonce_mode = None
+    if args.nKaminsky: nonce_mode = 1
+    if args.nKratochvil: nonce_mode = 2
+
+    marker_mode = None
+    if args.mKaminsky: marker_mode = 1
+    if args.mKratochvil: marker_mode = 2
 
-    tiles = list(zip(letters, [(x // size, x % size) for x in range(size * size)]))
+    profile = None
+    if args.profile and args.profile_format == 'cprofile':
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        atexit.register(lambda: profiler.dump_stats(args.profile))
+    elif args.profile:
+        profile = Profile()
+        atexit.register(profile.dump, args.profile)
+
+    try:
+        cipher = Cipher(7 if args.ls47 else 6, args.playingcard, marker_mode, nonce_mode, profile=profile,
+                        alphabet=args.alphabet)
+    except ValueError as e:
+        parser.error(str(e))
 
     # set nonce
 
     if args.noncestring:
         nonce = args.noncestring
     elif args.noncelen:
-        nonce = create_random_nonce(args.noncelen)
+        nonce = cipher.create_random_nonce(args.noncelen)
     else:
         nonce = ""
 
-    check_nonce(nonce)
-    nonce_size = len(nonce)
-    nonce_enc = ""
-
-    # set nonce mode
-
-    nonce_mode = 1 if size==6 else 2
-    if args.nKaminsky: nonce_mode = 1
-    if args.nKratochvil: nonce_mode = 2
-
-    # set marker mode
-
-    marker_mode = 1 if size==6 else 2
-    if args.mKaminsky: marker_mode = 1
-    if args.mKratochvil: marker_mode = 2
+    cipher.check_nonce(nonce)
 
     # set key
 
-    key = letters
-
-    # helper variables for verbose printing via printinfo()
-
-    szkeyword = '' # global variable which can be changed in test1() [so it can be used as test condition in printinfo() instead of args.keywordstring and instead of test1() manipulating args.keywordstring]
-    szsignature = '' # global variable which can be changed in test1() [so it can be used as test condition in printinfo() instead of args.keywordstring and instead of test1() manipulating args.keywordstring].  # Allows to use -s besides -t
-
-    if args.signature: # This case here is only necessary if -s should be used together with -t
-        szsignature = args.signature
-
+    key = cipher.letters
 
     if args.keywordfile: args.keywordstring = open(args.keywordfile, 'r').read().rstrip('\r\n')
     if args.keywordstring:
-        szkeyword = args.keywordstring
-        key = derive_key(args.keywordstring, args.playingcard)
+        key = cipher.derive_key(args.keywordstring)
+
+    if args.keyid:
+        if not args.keyring:
+            parser.error("-ki requires --keyring")
+        try:
+            keyring = Keyring(args.keyring, cipher.alphabet, cipher.playingcard)
+        except (IOError, ValueError) as e:
+            parser.error(str(e))
+        try:
+            args.keystring = keyring[args.keyid]
+        except KeyError:
+            parser.error("no key %s for this alphabet in %s" % (args.keyid, args.keyring))
+        finally:
+            keyring.close()
 
     if args.keyfile: args.keystring = open(args.keyfile, 'r').read().rstrip('\r\n')
     if args.keystring: key = args.keystring;
 
-    initialkey = key
-    check_key(key)
+    cipher.check_key(key)
+
+    # information for verbose printing via printinfo()
+
+    info = dict(keyword=args.keywordstring, key=key, nonce=nonce, nonce_enc='', signature=args.signature)
 
-    mp = (0, 0)
+    def verify_signature(check):
+        if check is not None and not check.ok:
+            eprint("--Error--: the plaintext does not end with the signature")
+            sys.exit(3)
+
+    check = None
 
     # encrypt / decrypt / test
 
+    if args.binary:
+        if not (args.encryptfile or args.decryptfile):
+            parser.error("--binary requires -ef or -df")
+        if args.checkpoint or args.mmap or args.container or args.index or args.normalize:
+            parser.error("--binary cannot be combined with --checkpoint, --mmap, --container, --index or --normalize")
+        if args.encryptfile:
+            s = cipher.encryptor(key, nonce)
+            stream_binary(s, cipher.check_plaintext, cipher.alphabet, args.encryptfile, args.output, args.chunk_size, True,
+                          args.signature or '')
+        else:
+            check = SignatureCheck(args.signature or '', strip=True)
+            s = VerifyingDecryptor(cipher.decryptor(key, len(nonce)), check)
+            stream_binary(s, cipher.check_ciphertext, cipher.alphabet, args.decryptfile, args.output, args.chunk_size, False)
+        info.update(nonce=s.nonce, nonce_enc=s.nonce_enc)
+        if args.verbose:
+            printinfo(cipher, info, bool(args.encryptfile), False)
+        verify_signature(check)
+        sys.exit(0)
+
+    if args.mmap:
+        if not (args.encryptfile or args.decryptfile) or '-' in (args.encryptfile, args.decryptfile, args.output):
+            parser.error("--mmap requires -ef or -df with a named FILE, and -o FILE")
+        if args.checkpoint or args.container or args.index or args.normalize:
+            parser.error("--mmap cannot be combined with --checkpoint, --container, --index or --normalize")
+        if args.encryptfile:
+            s = cipher.encryptor(key, nonce)
+            crypt_mmap(s, cipher.check_plaintext, args.encryptfile, args.output, args.chunk_size, True, args.signature or '')
+        else:
+            s = cipher.decryptor(key, len(nonce))
+            crypt_mmap(s, cipher.check_ciphertext, args.decryptfile, args.output, args.chunk_size, False)
+            if args.signature:
+                with open(args.output, 'rb') as f:
+                    f.seek(max(os.path.getsize(args.output) - len(args.signature) - 1, 0))
+                    check = SignatureCheck(args.signature)
+                    check(f.read().decode('ascii').rstrip('\n'))
+        info.update(nonce=s.nonce, nonce_enc=s.nonce_enc)
+        if args.verbose:
+            printinfo(cipher, info, bool(args.encryptfile), False)
+        verify_signature(check)
+        sys.exit(0)
+
+    if args.container:
+        if not (args.encryptfile or args.decryptfile):
+            parser.error("--container requires -ef or -df")
+        if args.checkpoint or args.index or args.normalize:
+            parser.error("--container cannot be combined with --checkpoint, --index or --normalize")
+        fin = open_input(args.encryptfile or args.decryptfile)
+        fout = open_output(args.output)
+        if args.encryptfile:
+            if args.noncestring or not args.noncelen:
+                parser.error("--container requires -nl, for a fresh nonce per chunk")
+            encrypt_container(cipher, key, fin, fout, args.chunk_size, args.noncelen, args.jobs, args.signature or '')
+        else:
+            check = SignatureCheck(args.signature or '')
+            decrypt_container(cipher, key, fin, fout, args.jobs, check)
+        verify_signature(check)
+        sys.exit(0)
+
+    if args.range or (args.index and args.decryptfile):
+        if not (args.range and args.index and args.decryptfile):
+            parser.error("--range requires -df and --index")
+        try:
+            (start, stop) = args.range.split(':')
+            (start, stop) = (int(start or 0), int(stop) if stop else None)
+        except ValueError:
+            parser.error("--range must be START:STOP")
+        with open(args.index, 'r') as f:
+            index = read_index(f)
+        with open(args.decryptfile, 'r') as f:
+            plaintext = decrypt_range(index, f, start, stop, profile)
+        out = open_output(args.output)
+        out.write(plaintext + '\n')
+        out.flush()
+        sys.exit(0)
+
+    if args.index:
+        if not args.encryptfile:
+            parser.error("--index requires -ef or -df")
+        args.stream = True
+
+    if args.checkpoint and args.decryptfile and args.signature:
+        parser.error("--checkpoint cannot be combined with -s when decrypting")
+    if args.checkpoint and args.normalize:
+        parser.error("--normalize cannot be combined with --checkpoint")
+    if args.normalize and not (args.encryptstring or args.encryptfile):
+        parser.error("--normalize requires -es or -ef")
+
+    if args.checkpoint and not args.stream:
+        parser.error("--checkpoint requires --stream")
+
+    if args.stream:
+        if not (args.encryptfile or args.decryptfile):
+            parser.error("--stream requires -ef or -df")
+        checkpoint = None
+        if args.checkpoint:
+            try:
+                checkpoint = Checkpoint(args.checkpoint, args.checkpoint_every, cipher, bool(args.encryptfile),
+                                        args.encryptfile or args.decryptfile, args.output, args.chunk_size,
+                                        args.signature or '')
+            except ValueError as e:
+                parser.error(str(e))
+        if args.encryptfile:
+            s = cipher.encryptor(key, nonce)
+            validate = cipher.check_plaintext
+            if args.index:
+                if checkpoint:
+                    parser.error("--index cannot be combined with --checkpoint")
+                fd = os.open(args.index, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                os.fchmod(fd, 0o600)  # also when an existing index is overwritten
+                index = os.fdopen(fd, 'w')
+                s = IndexedEncryptor(s, index, args.index_every)
+            signature = args.signature
+            if args.normalize:
+                normalizer = cipher.normalizer()
+                s = NormalizingEncryptor(s, normalizer, signature or '')
+                validate = lambda chunk: None
+                signature = ''
+            stream(s, validate, args.encryptfile, args.output, args.chunk_size, signature, checkpoint)
+            if args.normalize and args.verbose:
+                eprint('ALTERED   : %d' % normalizer.altered)
+        else:
+            s = cipher.decryptor(key, len(nonce))
+            if args.signature:
+                check = SignatureCheck(args.signature)
+                s = VerifyingDecryptor(s, check)
+            stream(s, cipher.check_ciphertext, args.decryptfile, args.output, args.chunk_size, checkpoint=checkpoint)
+        info.update(nonce=s.nonce, nonce_enc=s.nonce_enc)
+        if args.verbose:
+            printinfo(cipher, info, bool(args.encryptfile), False)
+        verify_signature(check)
+        sys.exit(0)
+
+    if args.encryptbatch or args.decryptbatch:
+        messages = read_batch(args.encryptbatch or args.decryptbatch)
+        if args.encryptbatch:
+            job = BatchJob(cipher, key, True, signature=args.signature)
+            if args.noncestring or args.noncelen:
+                messages = (msg if 'nonce' in msg or 'error' in msg else dict(msg, nonce=args.noncestring or cipher.create_random_nonce(args.noncelen))
+                            for msg in messages)
+        else:
+            job = BatchJob(cipher, key, False, len(nonce), args.signature)
+        failed = unsigned = 0
+        out = open_output(args.output)
+        for result in batch(job, messages, args.jobs):
+            failed += 'error' in result
+            unsigned += result.get('signature') is False
+            out.write(json.dumps(result) + '\n')
+        out.flush()
+        if failed and args.verbose:
+            eprint("--Warning--: %d message(s) failed" % failed)
+        if unsigned:
+            eprint("--Error--: %d plaintext(s) do not end with the signature" % unsigned)
+            sys.exit(3)
+        sys.exit(0)
+
     if args.encryptfile:
-        args.encryptstring = open(args.encryptfile, 'r').read().rstrip('\r\n')
+        args.encryptstring = open_input(args.encryptfile).read().rstrip('\r\n')
 
     if args.decryptfile:
-        args.decryptstring = open(args.decryptfile, 'r').read().rstrip('\r\n')
+        args.decryptstring = open_input(args.decryptfile).read().rstrip('\r\n')
 
     if args.encryptstring:
         plaintext = args.encryptstring
+        if args.normalize:
+            normalizer = cipher.normalizer()
+            plaintext = normalizer(plaintext)
+            if args.verbose:
+                eprint('ALTERED   : %d' % normalizer.altered)
         if args.signature:
             plaintext += args.signature
-        check_plaintext(plaintext)
-        ciphertext = encrypt_with_nonce(plaintext)
+        cipher.check_plaintext(plaintext)
+        e = cipher.encryptor(key, nonce)
+        ciphertext = e.update(plaintext) + e.final()
         if args.verbose:
-            printinfo(True)
+            info.update(nonce_enc=e.nonce_enc, plaintext=plaintext, ciphertext=ciphertext)
+            printinfo(cipher, info, True)
         else:
             print(ciphertext)
 
+    elif args.decryptstring and args.route:
+        ciphertext = args.decryptstring
+        cipher.check_ciphertext(ciphertext)
+        if is_keyring(args.route):
+            keyring = Keyring(args.route, cipher.alphabet, cipher.playingcard)
+        else:
+            with open(args.route, 'r') as f:
+                keyring = json.load(f)
+        for k in keyring.values():
+            cipher.check_key(k)
+        signature = args.signature or ''
+        try:
+            router = Router(cipher, keyring, len(nonce), signature, -len(signature), args.plausible, args.jobs)
+        except ValueError as e:
+            parser.error(str(e) + " (use -s or --plausible)")
+        try:
+            matches = router.route(ciphertext)
+        finally:
+            router.close()
+        for i in matches:
+            print(i)
+        sys.exit(0 if matches else 1)
+
     elif args.decryptstring:
         ciphertext = args.decryptstring
-        check_ciphertext(ciphertext)
-        plaintext = decrypt_with_nonce(ciphertext)
-        if args.signature and args.verbose:
-            eprint("--Warning--: the given signature is ignored during decryption")
-            # Maybe later return result of a check whether given signature equals the end of the decrypted string.
+        cipher.check_ciphertext(ciphertext)
+        check = SignatureCheck(args.signature or '')
+        d = VerifyingDecryptor(cipher.decryptor(key, len(nonce)), check)
+        plaintext = d.update(ciphertext) + d.final()
         if args.verbose:
-            printinfo()
+            info.update(nonce=d.nonce, nonce_enc=d.nonce_enc, plaintext=plaintext, ciphertext=ciphertext)
+            printinfo(cipher, info)
         else:
             print(plaintext)
+        verify_signature(check)
 
     elif args.test:
         print('\nVersion: ' + version)
         print('\n---Test: No nonce provided (only its length), so each call will produce a different ciphertext.')
-        size = 7; test1(size, 0)
-        size = 6; test1(size, 0)
+        test1(7, 0, args.keywordstring, args.signature)
+        test1(6, 0, args.keywordstring, args.signature)
         print('\n---Test: Nonce provided as string.')
-        size = 7; test1(size, 1)
-        size = 6; test1(size, 1)
+        test1(7, 1, args.keywordstring, args.signature)
+        test1(6, 1, args.keywordstring, args.signature)
         sys.exit(1)
 
     else: # you'll never get here (handled via argparse)
         # if args.verbose: print('Version   : ' + version)
-        print('ALPHABET  : ' + letters)
-        print('KEY       : ' + initialkey)
+        print('ALPHABET  : ' + cipher.letters)
+        print('KEY       : ' + key)
         print('NONCE     : ' + nonce)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This software is hereby released into public domain. Use it wisely.
+#
+# Keyword strength audit for lc4.py: runs a known-plaintext attack with a
+# dictionary of candidate keywords against a ciphertext, to see how quickly
+# an operator-chosen keyword (for -ws/-wf) falls.
+#
+# For every candidate, the key is derived and the ciphertext is decrypted
+# only as far as needed to reject it: up to the known part of the plaintext,
+# and then letter by letter until the first mismatch. The wordlist is
+# streamed and the candidates are spread over all CPUs.
+#
+# Sample calls:
+# // the signature at the end of a LS47 message (see ls47.encrypt_pad)
+# python lc4audit.py -7 -m1 -nl 10 -ds "$MESSAGE" --known=---peace-vector-3 --suffix -w words.txt
+# // a known header at the start of a LC4 message
+# python lc4audit.py -6 -nl 6 -df message.txt --known attn_ -w words.txt -j 8
+
+import sys
+import time
+import argparse
+
+import lc4
+
+
+class AuditJob(object):
+    """
+    Picklable worker: tries a list of candidate keywords, returning the
+    number of tried candidates, the number of skipped ones (with letters not
+    in the alphabet) and the hits.
+    """
+
+    def __init__(self, cipher, ciphertext, known, offset, nonce_size):
+        self.cipher = cipher
+        self.ciphertext = ciphertext
+        self.known = known
+        self.offset = offset
+        self.nonce_size = nonce_size
+
+    def __call__(self, words):
+        cipher = self.cipher
+        skipped = 0
+        hits = []
+        for word in words:
+            try:
+                # uncached: a dictionary would only flush the key cache
+                key = lc4.derive_key(word, cipher.playingcard, cipher.alphabet)
+            except ValueError:
+                skipped += 1
+                continue
+            if cipher.trial(key, self.ciphertext, self.known, self.offset, self.nonce_size):
+                hits.append(word)
+        return (len(words) - skipped, skipped, hits)
+
+
+def read_words(f, chunk):
+    words = []
+    for line in f:
+        word = line.rstrip('\r\n')
+        if word:
+            words.append(word)
+        if len(words) >= chunk:
+            yield words
+            words = []
+    if words:
+        yield words
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Audit LC4/LS47 keywords with a known-plaintext dictionary attack")
+
+    mgroup1 = parser.add_mutually_exclusive_group()
+    mgroup1.add_argument("-6", "--lc4", help="use ElsieFour cipher (6x6 table) (default)", action="store_true")
+    mgroup1.add_argument("-7", "--ls47", help="use LS47 cipher (7x7 table)", action="store_true")
+    parser.add_argument("-pc", "--playingcard", help="Use the \"playing card\" character tables (default: standard tables)", action="store_true")
+
+    mgroup2 = parser.add_mutually_exclusive_group(required=True)
+    mgroup2.add_argument("-ds", "--decryptstring", metavar="STRING", help="audit against the ciphertext STRING")
+    mgroup2.add_argument("-df", "--decryptfile", metavar="FILE", help="read the ciphertext from FILE")
+
+    parser.add_argument("-nl", "--noncelen", metavar="LENGTH", help="the ciphertext has a nonce of length LENGTH (default: no nonce)", type=lc4.non_negative, default=0)
+
+    mgroup5 = parser.add_mutually_exclusive_group()
+    mgroup5.add_argument("-n0", "--nKaminsky", help="use nonce in Kaminsky mode (default for LC4)", action="store_true")
+    mgroup5.add_argument("-n1", "--nKratochvil", help="use nonce in Kratochvil mode (default for LS47)", action="store_true")
+
+    mgroup6 = parser.add_mutually_exclusive_group()
+    mgroup6.add_argument("-m0", "--mKaminsky", help="use marker in Kaminsky mode (default for LC4)", action="store_true")
+    mgroup6.add_argument("-m1", "--mKratochvil", help="use marker in Kratochvil mode (default for LS47)", action="store_true")
+
+    parser.add_argument("--known", metavar="STRING", help="known part of the plaintext", required=True)
+    mgroup7 = parser.add_mutually_exclusive_group()
+    mgroup7.add_argument("--offset", metavar="N", help="position of the known part in the plaintext, negative counts from the end (default: 0)", type=int, default=0)
+    mgroup7.add_argument("--suffix", help="the known part ends the plaintext (e.g. a signature)", action="store_true")
+
+    parser.add_argument("-w", "--wordlist", metavar="FILE", help="candidate keywords, one per line (- for stdin)", required=True)
+    parser.add_argument("-j", "--jobs", metavar="N", help="number of worker processes (default: number of CPUs)", type=lc4.positive, default=None)
+    parser.add_argument("--chunk", metavar="N", help="candidates per work unit (default: 1000)", type=lc4.positive, default=1000)
+    parser.add_argument("-v", "--verbose", help="report progress on stderr", action="count", default=0)
+
+    args = parser.parse_args()
+
+    nonce_mode = 1 if args.nKaminsky else 2 if args.nKratochvil else None
+    marker_mode = 1 if args.mKaminsky else 2 if args.mKratochvil else None
+    cipher = lc4.Cipher(7 if args.ls47 else 6, args.playingcard, marker_mode, nonce_mode)
+
+    ciphertext = args.decryptstring
+    if args.decryptfile:
+        ciphertext = lc4.open_input(args.decryptfile).read().rstrip('\r\n')
+    cipher.check_ciphertext(ciphertext)
+    offset = -len(args.known) if args.suffix else args.offset
+
+    job = AuditJob(cipher, ciphertext, args.known, offset, args.noncelen)
+    f = lc4.open_input(args.wordlist)
+    # bounded: the wordlist is read only as fast as the candidates are tried
+    results = lc4.pipeline(job, read_words(f, args.chunk), args.jobs)
+
+    tested = skipped = found = 0
+    start = time.time()
+    try:
+        for (n, s, hits) in results:
+            tested += n
+            skipped += s
+            for word in hits:
+                found += 1
+                print('HIT       : ' + word)
+                sys.stdout.flush()
+            if args.verbose:
+                lc4.eprint('TESTED    : %d (%.0f/s)' % (tested, tested / max(time.time() - start, 1e-9)))
+    finally:
+        results.close()
+    elapsed = max(time.time() - start, 1e-9)
+
+    lc4.eprint('TESTED    : %d' % tested)
+    lc4.eprint('SKIPPED   : %d (letters not in the alphabet)' % skipped)
+    lc4.eprint('HITS      : %d' % found)
+    lc4.eprint('SECONDS   : %.2f' % elapsed)
+    lc4.eprint('RATE      : %.0f candidates/s' % (tested / elapsed))
+
+
+if __name__ == '__main__':
+    main()
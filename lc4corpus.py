@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This software is hereby released into public domain. Use it wisely.
+#
+# Differential conformance corpus for the LS47 engines: ls47.py (its
+# LS47State engine), lc4.py -7 -m1 -n1 (whole messages and streamed in
+# random chunks) and, when NumPy is available, the lockstep engine through
+# both modules. The reference is the original string implementation,
+# ls47.reference_encrypt() and ls47._derive_key(), which none of the
+# optimized engines share; when generating, ls47.reference_decrypt() must
+# also get every plaintext back from the reference ciphertext.
+#
+# Every case is a random keyword, a 10 letter nonce (as in ls47.encrypt_pad)
+# and a random plaintext; LS47 encrypts nonce + plaintext, which is what
+# lc4.py does in Kratochvil nonce mode. Each engine derives the key,
+# encrypts and decrypts the case, and the first result that differs from
+# the reference is reported. The cases are spread over all CPUs in batches.
+#
+# The cases and the reference results are written to a gzipped JSON lines
+# corpus (a header, then [keyword, nonce, plaintext, key, ciphertext] per
+# case), which --check replays against the engines later, e.g. after
+# performance work.
+#
+# Sample calls:
+# python lc4corpus.py -n 1000000 --seed 47 -o ls47-corpus.jsonl.gz
+# python lc4corpus.py --check ls47-corpus.jsonl.gz --engines lc4,lc4-stream
+#
+# Exit status: 0 = all engines agree, 1 = divergence found.
+
+import sys
+import gzip
+import json
+import time
+import random
+import argparse
+import itertools
+
+import lc4
+import ls47
+
+
+nonce_size = ls47.padding_size
+
+
+def available_engines():
+    names = ['ls47', 'lc4', 'lc4-stream']
+    try:
+        import lockstep
+        names += ['ls47-numpy', 'lc4-numpy']
+    except ImportError:
+        pass
+    return names
+
+
+def make_cases(seed, first, count, length):
+    """The random (keyword, nonce, plaintext) cases first to first+count of the seed."""
+    rnd = random.Random('%s-%d' % (seed, first))
+    letters = ls47.letters
+    cases = []
+    for i in range(count):
+        keyword = ''.join(rnd.choice(letters) for j in range(rnd.randint(1, 30)))
+        nonce = ''.join(rnd.choice(letters) for j in range(nonce_size))
+        plaintext = ''.join(rnd.choice(letters) for j in range(rnd.randint(0, length)))
+        cases.append((keyword, nonce, plaintext))
+    return cases
+
+
+def first_difference(a, b):
+    for (i, (x, y)) in enumerate(zip(a, b)):
+        if x != y:
+            return i
+    return min(len(a), len(b))
+
+
+class CorpusJob(object):
+    """
+    Picklable worker: called with (index of the first case, cases), where
+    cases are the stored [keyword, nonce, plaintext, key, ciphertext] of a
+    corpus, or the number of cases to generate from the seed. Returns (first,
+    records, divergence), with the records of the cases (with the reference
+    results when generating) and the first divergence as a dict, or None.
+    """
+
+    def __init__(self, engines, seed=None, length=100):
+        self.engines = engines
+        self.seed = seed
+        self.length = length
+
+    def __call__(self, work):
+        (first, cases) = work
+        if isinstance(cases, int):
+            records = [(keyword, nonce, plaintext, ls47._derive_key(keyword), None)
+                       for (keyword, nonce, plaintext) in make_cases(self.seed, first, cases, self.length)]
+            records = [r[:4] + (ls47.reference_encrypt(r[3], r[1] + r[2]),) for r in records]
+            for (i, (keyword, nonce, plaintext, key, ciphertext)) in enumerate(records):
+                got = ls47.reference_decrypt(key, ciphertext)
+                if got != nonce + plaintext:
+                    return (first, records, dict(case=first + i, engine='reference', operation='decrypt',
+                                                 keyword=keyword, nonce=nonce, plaintext=plaintext,
+                                                 expected=nonce + plaintext, got=got,
+                                                 position=first_difference(nonce + plaintext, got)))
+        else:
+            records = [tuple(c) for c in cases]
+        return (first, records, self.check(first, records))
+
+    def check(self, first, records):
+        cipher = lc4.Cipher(7, marker_mode=2, nonce_mode=2, key_cache=lc4.KeyCache(0), prefix_cache=lc4.PrefixCache(0))
+        results = dict((name, []) for name in self.engines)
+        keys = [r[3] for r in records]
+        texts = [r[1] + r[2] for r in records]
+        rnd = random.Random(first)
+        for (keyword, nonce, plaintext, key, ciphertext) in records:
+            if 'ls47' in results:
+                results['ls47'].append((ls47._derive_key(keyword), ls47.encrypt(key, nonce + plaintext),
+                                        ls47.decrypt(key, ciphertext)[nonce_size:]))
+            if 'lc4' in results:
+                results['lc4'].append((lc4.derive_key(keyword, False, cipher.alphabet),
+                                       cipher.encrypt_with_nonce(key, plaintext, nonce),
+                                       cipher.decrypt_with_nonce(key, ciphertext, nonce_size)))
+            if 'lc4-stream' in results:
+                cuts = sorted(rnd.randint(0, len(plaintext)) for i in range(3))
+                parts = [plaintext[a:b] for (a, b) in zip([0] + cuts, cuts + [len(plaintext)])]
+                e = cipher.encryptor(key, nonce)
+                enc = ''.join(e.update(p) for p in parts) + e.final()
+                parts = [ciphertext[a:b] for (a, b) in zip([0] + cuts, cuts + [len(ciphertext)])]
+                d = cipher.decryptor(key, nonce_size)
+                dec = ''.join(d.update(p) for p in parts) + d.final()
+                results['lc4-stream'].append((key, enc, dec))
+        if 'ls47-numpy' in results:
+            enc = ls47.encrypt_many(keys, texts, 'numpy')
+            dec = ls47.decrypt_many(keys, [r[4] for r in records], 'numpy')
+            results['ls47-numpy'] = [(k, c, p[nonce_size:]) for (k, c, p) in zip(keys, enc, dec)]
+        if 'lc4-numpy' in results:
+            enc = cipher.encrypt_many(keys, texts, 'numpy')
+            dec = cipher.decrypt_many(keys, [r[4] for r in records], 'numpy')
+            results['lc4-numpy'] = [(k, c, p[nonce_size:]) for (k, c, p) in zip(keys, enc, dec)]
+
+        for (i, (keyword, nonce, plaintext, key, ciphertext)) in enumerate(records):
+            for name in self.engines:
+                for (what, expected, got) in zip(('derive_key', 'encrypt', 'decrypt'),
+                                                 (key, ciphertext, plaintext), results[name][i]):
+                    if got != expected:
+                        return dict(case=first + i, engine=name, operation=what, keyword=keyword, nonce=nonce,
+                                    plaintext=plaintext, expected=expected, got=got,
+                                    position=first_difference(expected, got))
+        return None
+
+
+def read_corpus(f, batch):
+    """Yield (index of the first case, cases) batches of a corpus file, after its header line."""
+    first = 0
+    while True:
+        cases = [json.loads(line) for line in itertools.islice(f, batch)]
+        if not cases:
+            return
+        yield (first, cases)
+        first += len(cases)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate or check a differential conformance corpus of the LS47 engines")
+    mgroup = parser.add_mutually_exclusive_group()
+    mgroup.add_argument("-n", "--cases", metavar="N", help="generate N random cases (default: 100000)", type=lc4.positive, default=100000)
+    mgroup.add_argument("--check", metavar="FILE", help="replay the corpus FILE instead")
+    parser.add_argument("-o", "--output", metavar="FILE", help="write the generated corpus to FILE (gzipped JSON lines)")
+    parser.add_argument("--seed", metavar="SEED", help="seed of the generated cases (default: random)")
+    parser.add_argument("-l", "--length", metavar="LENGTH", help="maximum plaintext length (default: 100)", type=lc4.non_negative, default=100)
+    parser.add_argument("--engines", metavar="NAME,...", help="engines to run (default: all available, %s)" % ', '.join(available_engines()),
+                        default=','.join(available_engines()))
+    parser.add_argument("-j", "--jobs", metavar="N", help="number of worker processes (default: number of CPUs)", type=lc4.positive, default=None)
+    parser.add_argument("--batch", metavar="N", help="cases per work unit (default: 1000)", type=lc4.positive, default=1000)
+    parser.add_argument("-v", "--verbose", help="report progress on stderr", action="count", default=0)
+    args = parser.parse_args()
+
+    engines = args.engines.split(',')
+    unknown = set(engines).difference(available_engines())
+    if unknown:
+        parser.error("unknown or unavailable engines: %s" % ', '.join(sorted(unknown)))
+
+    out = None
+    if args.check:
+        f = gzip.open(args.check, 'rt')
+        header = json.loads(f.readline())
+        if header.get('format') != 'ls47-corpus' or header.get('nonce_size') != nonce_size:
+            parser.error("%s is not a corpus file" % args.check)
+        job = CorpusJob(engines)
+        work = read_corpus(f, args.batch)
+        print('CORPUS    : %s (seed %s, %d cases)' % (args.check, header['seed'], header['cases']))
+    else:
+        seed = args.seed or '%016x' % random.SystemRandom().getrandbits(64)
+        job = CorpusJob(engines, seed, args.length)
+        work = ((first, min(args.batch, args.cases - first)) for first in range(0, args.cases, args.batch))
+        if args.output:
+            out = gzip.open(args.output, 'wt')
+            out.write(json.dumps(dict(format='ls47-corpus', seed=seed, cases=args.cases, length=args.length,
+                                      nonce_size=nonce_size, letters=ls47.letters)) + '\n')
+        print('SEED      : %s' % seed)
+    print('ENGINES   : %s' % ', '.join(engines))
+    sys.stdout.flush()
+
+    # a bounded number of batches in flight, so that corpora of any size fit in memory
+    results = lc4.pipeline(job, work, args.jobs)
+
+    cases = letters = 0
+    divergence = None
+    start = time.time()
+    try:
+        for (first, records, divergence) in results:
+            if out is not None:
+                for r in records:
+                    out.write(json.dumps(r) + '\n')
+            cases += len(records)
+            letters += sum(len(r[1]) + len(r[2]) for r in records)
+            if divergence is not None:
+                break
+            if args.verbose:
+                lc4.eprint('CASES     : %d (%.0f/s)' % (cases, cases / max(time.time() - start, 1e-9)))
+    finally:
+        results.close()
+        if out is not None:
+            out.close()
+    elapsed = max(time.time() - start, 1e-9)
+
+    print('CASES     : %d' % cases)
+    print('LETTERS   : %d' % letters)
+    print('SECONDS   : %.2f' % elapsed)
+    if divergence is None:
+        print('RESULT    : all engines agree')
+        return
+    print('RESULT    : divergence')
+    for k in ('case', 'engine', 'operation', 'keyword', 'nonce', 'plaintext', 'expected', 'got', 'position'):
+        print('%-10s: %s' % (k.upper(), divergence[k]))
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
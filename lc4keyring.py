@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This software is hereby released into public domain. Use it wisely.
+#
+# Builds and updates keyring files for lc4.py (-ki ID --keyring FILE, and
+# --route FILE): the keys derived from keywords, stored per key id and
+# alphabet configuration in fixed-size sorted records, which lc4.Keyring
+# looks up through a memory map without deriving anything.
+#
+# Updates are incremental: keys whose keyword did not change are kept as
+# they are, and the file is replaced atomically. A keyring holds the keys
+# themselves, so it is created readable only by its owner.
+#
+# Sample calls:
+# // add or update the keys of a JSON file {"id": "keyword", ...} for LC4 and LS47
+# python lc4keyring.py keys.lc4k --add keywords.json
+# python lc4keyring.py keys.lc4k -7 --add keywords.json
+# python lc4keyring.py keys.lc4k -7 --remove alice --list
+# python lc4.py -7 --keyring keys.lc4k -ki bob -es conflagrate_the_rose_bush_at_six! -nl 10
+
+import sys
+import json
+import argparse
+
+import lc4
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and update keyring files of derived LC4/LS47 keys")
+    parser.add_argument("keyring", metavar="FILE", help="the keyring file (created if missing)")
+
+    mgroup1 = parser.add_mutually_exclusive_group()
+    mgroup1.add_argument("-6", "--lc4", help="use ElsieFour cipher (6x6 table) (default)", action="store_true")
+    mgroup1.add_argument("-7", "--ls47", help="use LS47 cipher (7x7 table)", action="store_true")
+    parser.add_argument("-pc", "--playingcard", help="Use the \"playing card\" character tables (default: standard tables)", action="store_true")
+    parser.add_argument("-a", "--alphabet", metavar="NAME", help="use the alphabet NAME (%s) or the given size*size letters, instead of -6/-7/-pc" % ', '.join(sorted(lc4.named_alphabets)))
+
+    parser.add_argument("--add", metavar="FILE", help="add or update the keys for the keywords of the JSON FILE ({\"id\": \"keyword\", ...}; - for stdin)")
+    parser.add_argument("--remove", metavar="ID", help="remove the key ID (may be repeated)", action="append", default=[])
+    parser.add_argument("--list", help="print the key ids of the configuration", action="store_true")
+    parser.add_argument("-v", "--verbose", help="also print the keys with --list", action="count", default=0)
+
+    args = parser.parse_args()
+    try:
+        cipher = lc4.Cipher(7 if args.ls47 else 6, args.playingcard, alphabet=args.alphabet)
+    except ValueError as e:
+        parser.error(str(e))
+
+    keywords = {}
+    if args.add:
+        keywords = json.load(lc4.open_input(args.add))
+        if not isinstance(keywords, dict) or not all(isinstance(w, str) for w in keywords.values()):
+            parser.error("--add needs a JSON object of key ids and keywords")
+    if keywords or args.remove:
+        try:
+            counts = lc4.update_keyring(args.keyring, cipher, keywords, args.remove)
+        except ValueError as e:
+            lc4.eprint("--Error--: " + str(e))
+            sys.exit(1)
+        lc4.eprint('KEYRING   : %s (%s)' % (args.keyring, cipher.name))
+        lc4.eprint('ADDED     : %d' % counts[0])
+        lc4.eprint('CHANGED   : %d' % counts[1])
+        lc4.eprint('UNCHANGED : %d' % counts[2])
+        lc4.eprint('REMOVED   : %d' % counts[3])
+
+    if args.list:
+        try:
+            keyring = lc4.Keyring(args.keyring, cipher.alphabet, cipher.playingcard)
+        except (IOError, ValueError) as e:
+            parser.error(str(e))
+        for (id, key) in keyring.items():
+            print('%s %s' % (id, key) if args.verbose else id)
+        keyring.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This software is hereby released into public domain. Use it wisely.
+#
+# Long-running LC4/LS47 service, so that applications do not have to start
+# lc4.py (and derive the key again) for every message.
+#
+# The server listens on a Unix socket or a localhost TCP port and speaks
+# line-delimited JSON: every request line is an object with an "op" and the
+# options of the lc4.py call it replaces, and gets one response line with the
+# same "id" (responses to pipelined requests may come in any order):
+#
+#   op        "encrypt", "decrypt", "derive" or "stats"
+#   size      6 or 7 (-6/-7, default 6)     playingcard  true/false (-pc)
+#   alphabet  name or letters (-a) of a     n, m         0 or 1 (-n0/-n1, -m0/-m1)
+#             registered alphabet
+#   key       key (-ks)                     keyword      keyword (-ws)
+#   text      plaintext or ciphertext       signature    appended when encrypting (-s)
+#   nonce     nonce (-ns)                   noncelen     random nonce length (-nl, up to
+#                                                        1024); for decrypt, the nonce length
+#
+# Responses carry "text" and "nonce" (encrypt/decrypt), "key" (derive) or
+# the latency metrics and key cache counters (stats); failures carry "error".
+#
+# Keys derived from keywords are kept in a shared cache. Messages longer
+# than --inline letters and key derivations are run on a pool of worker
+# processes, so that the event loop keeps serving other connections.
+#
+# Sample calls:
+# python lc4server.py --unix /tmp/lc4.sock -j 4
+# echo '{"id": 1, "op": "encrypt", "keyword": "thisismysecretkey", "text": "its_my_fathers_son", "noncelen": 6}' | nc -U /tmp/lc4.sock
+# python lc4server.py --port 4747
+# echo '{"id": 2, "op": "decrypt", "size": 7, "m": 0, "keyword": "s3cret_p4ssw0rd/31337", "noncelen": 10, "text": "..."}' | nc localhost 4747
+
+import os
+import stat
+import json
+import time
+import signal
+import asyncio
+import argparse
+import collections
+import concurrent.futures
+
+import lc4
+
+
+ops = ('encrypt', 'decrypt', 'derive', 'stats')
+max_noncelen = 1024
+
+ciphers = {}
+
+
+def cipher_for(req):
+    """The lc4.Cipher for the configuration options of a request (memoized per process)."""
+    alphabet = req.get('alphabet')
+    if alphabet is not None:
+        # only registered alphabets, so that clients cannot make the caches
+        # (here, and the per-alphabet tables in lc4) grow without bound
+        alphabet = lc4.named_alphabets.get(alphabet, alphabet)
+        if alphabet not in lc4.named_alphabets.values():
+            raise ValueError("Unknown alphabet: %r" % req['alphabet'])
+    config = (req.get('size', 6), bool(req.get('playingcard')), alphabet, req.get('n'), req.get('m'))
+    cipher = ciphers.get(config)
+    if cipher is None:
+        (size, playingcard, alphabet, n, m) = config
+        if size not in (6, 7):
+            raise ValueError("size must be 6 or 7")
+        if n not in (None, 0, 1) or m not in (None, 0, 1):
+            raise ValueError("n and m must be 0 or 1")
+        cipher = lc4.Cipher(size, playingcard, None if m is None else m + 1, None if n is None else n + 1,
+                            alphabet=alphabet)
+        ciphers[config] = cipher
+    return cipher
+
+
+def noncelen(req):
+    n = req.get('noncelen', 0)
+    if not isinstance(n, int) or isinstance(n, bool) or not 0 <= n <= max_noncelen:
+        raise ValueError("noncelen must be an integer from 0 to %d" % max_noncelen)
+    return n
+
+
+def derive(cipher, keyword):
+    return lc4.derive_key(keyword, cipher.playingcard, cipher.alphabet)
+
+
+def crypt(cipher, key, encrypting, text, nonce):
+    """
+    Run one encrypt/decrypt request (in a worker process, or inline); when
+    decrypting, nonce is the nonce length.
+    """
+    cipher.check_key(key)
+    if encrypting:
+        cipher.check_nonce(nonce)
+        cipher.check_plaintext(text)
+        return dict(text=cipher.encrypt_with_nonce(key, text, nonce), nonce=nonce)
+    cipher.check_ciphertext(text)
+    d = cipher.decryptor(key, nonce)
+    plaintext = d.update(text) + d.final()
+    return dict(text=plaintext, nonce=d.nonce)
+
+
+class Metrics(object):
+    """Request counts, errors and latencies per operation, over the last window requests."""
+
+    def __init__(self, window=1000):
+        self.counts = collections.Counter()
+        self.errors = collections.Counter()
+        self.latencies = collections.defaultdict(lambda: collections.deque(maxlen=window))
+
+    def add(self, op, seconds, error=False):
+        self.counts[op] += 1
+        self.errors[op] += bool(error)
+        self.latencies[op].append(seconds)
+
+    def report(self):
+        report = {}
+        for (op, recent) in self.latencies.items():
+            recent = sorted(recent)
+            pick = lambda q: recent[min(int(q * len(recent)), len(recent) - 1)] * 1000
+            report[op] = dict(count=self.counts[op], errors=self.errors[op],
+                              mean_ms=sum(recent) * 1000 / len(recent),
+                              p50_ms=pick(0.5), p90_ms=pick(0.9), p99_ms=pick(0.99), max_ms=recent[-1] * 1000)
+        return report
+
+
+class Server(object):
+    """
+    The request handler: requests go through handle(), which offloads the
+    work to the pool (None: everything is done inline) and records metrics.
+    A pool broken by a dead worker is replaced by a new one of jobs workers.
+    """
+
+    def __init__(self, pool=None, inline=256, key_cache=None, jobs=None):
+        self.pool = pool
+        self.jobs = jobs
+        self.inline = inline
+        self.key_cache = key_cache or lc4.KeyCache(4096)
+        self.deriving = {}
+        self.metrics = Metrics()
+
+    async def run(self, small, fn, *args):
+        pool = self.pool
+        if pool is None or small:
+            return fn(*args)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+        except concurrent.futures.process.BrokenProcessPool:
+            # the requests in flight fail, the later ones go to a new pool
+            if self.pool is pool:
+                self.pool = concurrent.futures.ProcessPoolExecutor(self.jobs)
+                pool.shutdown(wait=False)
+            raise
+
+    async def key(self, cipher, req):
+        if req.get('key') is not None:
+            return req['key']
+        keyword = req.get('keyword')
+        if keyword is None:
+            raise ValueError("A key or a keyword is required")
+        k = (keyword, cipher.letters, bool(cipher.playingcard))
+        key = self.key_cache.get(k)
+        if key is not None:
+            return key
+        # concurrent requests with the same new keyword share one derivation
+        pending = self.deriving.get(k)
+        if pending is None:
+            pending = self.deriving[k] = asyncio.ensure_future(
+                self.run(len(keyword) <= self.inline, derive, cipher, keyword))
+            pending.add_done_callback(lambda f: self.deriving.pop(k, None))
+        key = await pending
+        self.key_cache.put(k, key)
+        return key
+
+    async def handle(self, req):
+        op = req.get('op')
+        if op == 'stats':
+            return dict(metrics=self.metrics.report(), key_cache=self.key_cache.stats())
+        if op not in ops:
+            raise ValueError("Unknown op: %r" % op)
+        cipher = cipher_for(req)
+        key = await self.key(cipher, req)
+        if op == 'derive':
+            return dict(key=key)
+        text = req.get('text')
+        if not isinstance(text, str):
+            raise ValueError("A text is required")
+        small = len(text) <= self.inline
+        if op == 'encrypt':
+            nonce = req.get('nonce')
+            if nonce is None:
+                nonce = cipher.create_random_nonce(noncelen(req))
+            return await self.run(small, crypt, cipher, key, True, text + (req.get('signature') or ''), nonce)
+        nonce_size = len(req['nonce']) if req.get('nonce') else noncelen(req)
+        return await self.run(small, crypt, cipher, key, False, text, nonce_size)
+
+    async def respond(self, line):
+        start = time.perf_counter()
+        req = op = None
+        try:
+            req = json.loads(line)
+            if not isinstance(req, dict):
+                raise ValueError("A request must be a JSON object")
+            op = req.get('op')
+            response = await self.handle(req)
+        except (ValueError, TypeError, KeyError) as e:
+            response = dict(error=str(e))
+        except concurrent.futures.process.BrokenProcessPool:
+            response = dict(error="worker pool failed")
+        if isinstance(req, dict) and 'id' in req:
+            response['id'] = req['id']
+        # unknown ops share one bucket, so that clients cannot grow the metrics
+        self.metrics.add(op if op in ops else 'invalid', time.perf_counter() - start, 'error' in response)
+        return json.dumps(response) + '\n'
+
+    async def connection(self, reader, writer):
+        # requests of one connection are run concurrently, a bounded number at a time
+        slots = asyncio.Semaphore(64)
+        tasks = set()
+
+        async def serve(line):
+            try:
+                writer.write((await self.respond(line)).encode('utf-8'))
+                await writer.drain()
+            finally:
+                slots.release()
+
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    writer.write(b'{"error": "request line too long"}\n')
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                await slots.acquire()
+                task = asyncio.ensure_future(serve(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.wait(tasks)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def is_socket(path):
+    try:
+        return stat.S_ISSOCK(os.lstat(path).st_mode)
+    except FileNotFoundError:
+        return False
+
+
+async def serve(args):
+    pool = None
+    if args.jobs != 0:
+        pool = concurrent.futures.ProcessPoolExecutor(args.jobs or None)
+    server = Server(pool, args.inline, jobs=args.jobs or None)
+    limit = args.max_line
+    if args.unix:
+        if is_socket(args.unix):
+            os.remove(args.unix)
+        # created owner-only, rather than chmod-ed once it is already listening
+        umask = os.umask(0o177)
+        try:
+            listener = await asyncio.start_unix_server(server.connection, args.unix, limit=limit)
+        finally:
+            os.umask(umask)
+    else:
+        listener = await asyncio.start_server(server.connection, args.host, args.port, limit=limit)
+    lc4.eprint('LISTENING : %s' % (args.unix or '%s:%d' % (args.host, args.port)))
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        async with listener:
+            await stop.wait()
+    finally:
+        if server.pool is not None:
+            server.pool.shutdown()
+        if args.unix and is_socket(args.unix):
+            os.remove(args.unix)
+        lc4.eprint('METRICS   : ' + json.dumps(server.metrics.report(), sort_keys=True))
+        lc4.eprint('KEY CACHE : ' + json.dumps(server.key_cache.stats(), sort_keys=True))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve LC4/LS47 encryption over line-delimited JSON")
+    mgroup = parser.add_mutually_exclusive_group(required=True)
+    mgroup.add_argument("--unix", metavar="PATH", help="listen on the Unix socket PATH (only accessible by the owner)")
+    mgroup.add_argument("--port", metavar="N", help="listen on TCP port N", type=int)
+    parser.add_argument("--host", metavar="HOST", help="TCP address to listen on (default: 127.0.0.1)", default="127.0.0.1")
+    parser.add_argument("-j", "--jobs", metavar="N", help="number of worker processes (default: number of CPUs; 0 = do all work in the server process)", type=lc4.non_negative, default=None)
+    parser.add_argument("--inline", metavar="N", help="handle messages of up to N letters in the server process (default: 256)", type=lc4.non_negative, default=256)
+    parser.add_argument("--max-line", metavar="BYTES", help="maximum length of a request line (default: 16777216)", type=lc4.positive, default=16 * 1024 * 1024)
+    args = parser.parse_args()
+    if args.unix and os.path.lexists(args.unix) and not is_socket(args.unix):
+        parser.error("--unix %s exists and is not a socket" % args.unix)
+    asyncio.run(serve(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This software is hereby released into public domain. Use it wisely.
+#
+# Statistics of LC4/LS47 ciphertexts over random keys, nonces and plaintexts,
+# for both marker modes, to see how often degenerate behaviour (like the
+# -m0 fixpoint in the lc4.py header, where '##############' encrypts to
+# itself) occurs.
+#
+# Every trial encrypts a random plaintext with a random key and nonce; for
+# the ciphertext following the nonce, the letter frequencies, the fixpoints
+# (ciphertext letter == plaintext letter), the repeats (ciphertext letter ==
+# previous ciphertext letter) and the longest runs of both are collected.
+# The trials are spread over all CPUs in batches, each batch returning a
+# Stats accumulator which is merged into the totals.
+#
+# Sample calls:
+# // the header case: plaintexts of one repeated letter, both marker modes
+# python lc4stats.py -6 -nl 6 --plaintext repeat -n 100000
+# // ten million letters of random LS47 plaintext, in lockstep with NumPy
+# python lc4stats.py -7 -m1 -n 100000 -l 100 --backend numpy
+
+import sys
+import os
+import math
+import time
+import random
+import operator
+import argparse
+import collections
+import multiprocessing
+
+import lc4
+
+
+class Stats(object):
+    """
+    Mergeable accumulator of the statistics of (plaintext, ciphertext) pairs,
+    given as bytes of letter indices.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.trials = 0
+        self.letters = 0
+        self.freq = [0] * size
+        self.fixpoints = 0
+        self.repeats = 0
+        self.identical = 0
+        # longest run of fixpoints / of the same ciphertext letter -> trials
+        self.fixpoint_runs = collections.Counter()
+        self.repeat_runs = collections.Counter()
+        self.chunks = []
+
+    def add(self, plaintext, ciphertext):
+        fix = bytes(map(operator.eq, plaintext, ciphertext))
+        rep = bytes(map(operator.eq, ciphertext, ciphertext[1:]))
+        nfix = fix.count(1)
+        self.trials += 1
+        self.letters += len(ciphertext)
+        self.fixpoints += nfix
+        self.repeats += rep.count(1)
+        if nfix == len(ciphertext):
+            self.identical += 1
+        self.fixpoint_runs[max(map(len, fix.split(b'\0')))] += 1
+        self.repeat_runs[max(map(len, rep.split(b'\0'))) + 1 if ciphertext else 0] += 1
+        # the letter frequencies are counted in bulk by flush()
+        self.chunks.append(ciphertext)
+
+    def flush(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        for i in range(self.size):
+            self.freq[i] += data.count(i)
+
+    def merge(self, other):
+        self.flush()
+        other.flush()
+        self.trials += other.trials
+        self.letters += other.letters
+        self.freq = [a + b for (a, b) in zip(self.freq, other.freq)]
+        self.fixpoints += other.fixpoints
+        self.repeats += other.repeats
+        self.identical += other.identical
+        self.fixpoint_runs.update(other.fixpoint_runs)
+        self.repeat_runs.update(other.repeat_runs)
+
+    def __getstate__(self):
+        self.flush()
+        return self.__dict__
+
+    def chi_square(self):
+        expected = float(self.letters) / self.size
+        if not expected:
+            return 0.0
+        return sum((n - expected) ** 2 for n in self.freq) / expected
+
+    def report(self, letters, out=sys.stdout):
+        self.flush()
+        n = self.size
+        total = max(self.letters, 1)
+        pairs = max(self.letters - self.trials, 1)
+        df = n - 1
+        chi2 = self.chi_square()
+        # Wilson-Hilferty approximation of the chi-square distribution
+        z = ((chi2 / df) ** (1.0 / 3) - (1 - 2.0 / (9 * df))) / math.sqrt(2.0 / (9 * df))
+        print('TRIALS    : %d' % self.trials, file=out)
+        print('LETTERS   : %d' % self.letters, file=out)
+        print('FIXPOINTS : %d (%.5f, expected %.5f)' % (self.fixpoints, float(self.fixpoints) / total, 1.0 / n), file=out)
+        print('REPEATS   : %d (%.5f, expected %.5f)' % (self.repeats, float(self.repeats) / pairs, 1.0 / n), file=out)
+        print('IDENTICAL : %d (ciphertext == plaintext)' % self.identical, file=out)
+        print('CHI2      : %.1f (%d degrees of freedom, z = %.2f)' % (chi2, df, z), file=out)
+        top = sorted(range(n), key=lambda i: self.freq[i])
+        print('RAREST    : %s' % ' '.join('%s:%d' % (letters[i], self.freq[i]) for i in top[:3]), file=out)
+        print('COMMONEST : %s' % ' '.join('%s:%d' % (letters[i], self.freq[i]) for i in top[:-4:-1]), file=out)
+        for (name, runs) in (('FIX RUN', self.fixpoint_runs), ('REP RUN', self.repeat_runs)):
+            line = ' '.join('%d:%d' % (k, runs[k]) for k in sorted(runs))
+            print('%-10s: %s (longest run -> trials)' % (name, line), file=out)
+
+
+class TrialJob(object):
+    """
+    Picklable worker: called with (batch number, number of trials), runs
+    that batch of random trials and returns their Stats.
+    """
+
+    def __init__(self, cipher, seed, length, noncelen, plaintext, backend):
+        self.cipher = cipher
+        self.seed = seed
+        self.length = length
+        self.noncelen = noncelen
+        self.plaintext = plaintext
+        self.backend = backend
+
+    def __call__(self, work):
+        (batch, trials) = work
+        cipher = self.cipher
+        letters = cipher.letters
+        rnd = random.Random('%s-%d-%d' % (self.seed, cipher.marker_mode, batch))
+        keys = []
+        texts = []
+        for i in range(trials):
+            key = list(letters)
+            rnd.shuffle(key)
+            keys.append(''.join(key))
+            nonce = ''.join(rnd.choice(letters) for j in range(self.noncelen))
+            if self.plaintext == 'repeat':
+                text = rnd.choice(letters) * self.length
+            else:
+                text = ''.join(rnd.choice(letters) for j in range(self.length))
+            texts.append(nonce + text)
+        # with either nonce mode, the message body is encrypted with the state
+        # left by encrypting the nonce
+        results = cipher.encrypt_many(keys, texts, self.backend)
+        stats = Stats(len(letters))
+        skip = self.noncelen
+        for (text, result) in zip(texts, results):
+            stats.add(cipher.alphabet.indices(text[skip:]), cipher.alphabet.indices(result[skip:]))
+        stats.flush()
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collect fixpoint and distribution statistics of LC4/LS47 ciphertexts")
+
+    mgroup1 = parser.add_mutually_exclusive_group()
+    mgroup1.add_argument("-6", "--lc4", help="use ElsieFour cipher (6x6 table) (default)", action="store_true")
+    mgroup1.add_argument("-7", "--ls47", help="use LS47 cipher (7x7 table)", action="store_true")
+    parser.add_argument("-pc", "--playingcard", help="Use the \"playing card\" character tables (default: standard tables)", action="store_true")
+
+    mgroup6 = parser.add_mutually_exclusive_group()
+    mgroup6.add_argument("-m0", "--mKaminsky", help="only use marker in Kaminsky mode (default: both modes)", action="store_true")
+    mgroup6.add_argument("-m1", "--mKratochvil", help="only use marker in Kratochvil mode (default: both modes)", action="store_true")
+
+    parser.add_argument("-n", "--trials", metavar="N", help="number of trials per marker mode (default: 100000)", type=int, default=100000)
+    parser.add_argument("-l", "--length", metavar="LENGTH", help="plaintext length (default: 100)", type=int, default=100)
+    parser.add_argument("-nl", "--noncelen", metavar="LENGTH", help="nonce length (default: 10)", type=int, default=10)
+    parser.add_argument("--plaintext", help="random letters, or one random letter repeated (default: random)", choices=['random', 'repeat'], default='random')
+    parser.add_argument("--seed", metavar="SEED", help="seed for the trials, to reproduce a run (default: random)")
+    parser.add_argument("--backend", help="encryption engine (default: python)", choices=['python', 'numpy'], default='python')
+    parser.add_argument("-j", "--jobs", metavar="N", help="number of worker processes (default: number of CPUs)", type=int, default=None)
+    parser.add_argument("--batch", metavar="N", help="trials per work unit (default: 1000)", type=int, default=1000)
+    parser.add_argument("-v", "--verbose", help="report progress on stderr", action="count", default=0)
+
+    args = parser.parse_args()
+
+    size = 7 if args.ls47 else 6
+    modes = [1] if args.mKaminsky else [2] if args.mKratochvil else [1, 2]
+    seed = args.seed or os.urandom(8).hex()
+    print('SEED      : %s' % seed)
+
+    pool = None if args.jobs == 1 else multiprocessing.Pool(args.jobs)
+    try:
+        for mm in modes:
+            cipher = lc4.Cipher(size, args.playingcard, marker_mode=mm)
+            job = TrialJob(cipher, seed, args.length, args.noncelen, args.plaintext, args.backend)
+            batches = [(i, min(args.batch, args.trials - i * args.batch))
+                       for i in range((args.trials + args.batch - 1) // args.batch)]
+            if pool is None:
+                results = (job(work) for work in batches)
+            else:
+                results = pool.imap_unordered(job, batches)
+            total = Stats(size * size)
+            start = time.time()
+            for stats in results:
+                total.merge(stats)
+                if args.verbose:
+                    lc4.eprint('LETTERS   : %d (%.0f/s)' % (total.letters, total.letters / max(time.time() - start, 1e-9)))
+            elapsed = max(time.time() - start, 1e-9)
+
+            print()
+            print('CIPHER    : %s -m%d, %s plaintext' % (cipher.name, mm - 1, args.plaintext))
+            total.report(cipher.letters)
+            print('SECONDS   : %.2f (%.0f letters/s)' % (elapsed, total.letters / elapsed))
+            sys.stdout.flush()
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This software is hereby released into public domain. Use it wisely.
+#
+# Lockstep LC4/LS47 engine for many independent messages, using NumPy.
+#
+# The cipher state update is sequential within one message, but the same
+# operations (row rotation, column rotation, marker update) happen for every
+# message of a batch. Here, N boards are kept as an (N, size*size) array of
+# letter indices, together with the inverse (letter -> position) array, and
+# all messages advance by one letter per step. Messages are sorted by length,
+# so that the messages still running at any step form a prefix of the arrays.
+#
+# This module needs NumPy; it is used by lc4.Cipher.encrypt_many() and
+# ls47.encrypt_many() with backend='numpy'.
+
+import numpy as np
+
+
+def _indices(strings, letters, what):
+    table = np.full(256, 255, dtype=np.uint8)
+    table[np.frombuffer(letters.encode('ascii'), dtype=np.uint8)] = np.arange(len(letters), dtype=np.uint8)
+    out = []
+    for s in strings:
+        try:
+            ix = table[np.frombuffer(s.encode('ascii'), dtype=np.uint8)]
+        except UnicodeEncodeError:
+            ix = np.full(1, 255, dtype=np.uint8)
+        if (ix == 255).any():
+            illegal = ''.join(sorted(set(s).difference(letters)))
+            raise ValueError("%s contains illegal letters: '%s'" % (what, illegal))
+        out.append(ix)
+    return out
+
+
+def _boards(keys, letters, n):
+    if isinstance(keys, str):
+        keys = [keys] * n
+    if len(keys) != n:
+        raise ValueError("Expected %d keys, got %d" % (n, len(keys)))
+    boards = _indices(keys, letters, "Key")
+    if any(len(b) != len(letters) for b in boards):
+        raise ValueError("Wrong key size")
+    boards = np.array(boards, dtype=np.intp).reshape(n, len(letters))
+    if not (np.sort(boards, axis=1) == np.arange(len(letters))).all():
+        raise ValueError("The key must be a permutation of the alphabet: %s" % letters)
+    return boards
+
+
+def crypt_many(keys, texts, letters, marker_mode, decrypting):
+    """
+    Encrypt (or decrypt) the list of texts, each with its key (keys may also
+    be a single key used for all texts), in lockstep. marker_mode is as in
+    lc4.py (1 = Kaminsky, marker moves with the rotations; 2 = Kratochvil).
+    """
+    n = len(texts)
+    if n == 0:
+        return []
+    size = int(round(len(letters) ** 0.5))
+    boards = _boards(keys, letters, n)
+    msgs = _indices(texts, letters, "Ciphertext" if decrypting else "Plaintext")
+
+    lengths = np.array([len(m) for m in msgs], dtype=np.intp)
+    order = np.argsort(-lengths, kind='stable')
+    lengths = lengths[order]
+    boards = boards[order]
+    steps = int(lengths[0])
+    data = np.zeros((n, steps), dtype=np.intp)
+    for (i, j) in enumerate(order):
+        data[i, :lengths[i]] = msgs[j]
+    # active[t] = number of messages still running at step t
+    active = np.searchsorted(-lengths, -np.arange(steps), side='left')
+
+    rows = np.arange(n)
+    pos = np.empty_like(boards)
+    pos[rows[:, None], boards] = np.arange(size * size)
+    mr = np.zeros(n, dtype=np.intp)
+    mc = np.zeros(n, dtype=np.intp)
+    out = np.zeros((n, steps), dtype=np.intp)
+    line = np.arange(size)
+    shifted = (line - 1) % size
+
+    for t in range(steps):
+        k = int(active[t])
+        r = rows[:k]
+        b = boards[:k]
+        ps = pos[:k]
+        x = data[:k, t]
+        mix = b[r, mr[:k] * size + mc[:k]]
+        (xr, xc) = np.divmod(ps[r, x], size)
+        if decrypting:
+            c = x
+            p = b[r, (xr - mix // size) % size * size + (xc - mix % size) % size]
+            out[:k, t] = p
+            pr = ps[r, p] // size
+        else:
+            p = x
+            c = b[r, (xr + mix // size) % size * size + (xc + mix % size) % size]
+            out[:k, t] = c
+            pr = xr
+
+        # rotate the plaintext row right
+        ix = (pr * size)[:, None] + line
+        moved = b[r[:, None], (pr * size)[:, None] + shifted]
+        b[r[:, None], ix] = moved
+        ps[r[:, None], moved] = ix
+        if marker_mode == 1:
+            mc[:k] = np.where(mr[:k] == pr, (mc[:k] + 1) % size, mc[:k])
+
+        # rotate the ciphertext column down
+        cc = ps[r, c] % size
+        ix = cc[:, None] + line * size
+        moved = b[r[:, None], cc[:, None] + shifted * size]
+        b[r[:, None], ix] = moved
+        ps[r[:, None], moved] = ix
+        if marker_mode == 1:
+            mr[:k] = np.where(mc[:k] == cc, (mr[:k] + 1) % size, mr[:k])
+
+        mr[:k] = (mr[:k] + c // size) % size
+        mc[:k] = (mc[:k] + c % size) % size
+
+    table = np.frombuffer(letters.encode('ascii'), dtype=np.uint8)
+    result = [None] * n
+    for (i, j) in enumerate(order):
+        result[j] = table[out[i, :lengths[i]]].tobytes().decode('ascii')
+    return result
+
+
+def encrypt_many(keys, plaintexts, letters, marker_mode):
+    return crypt_many(keys, plaintexts, letters, marker_mode, False)
+
+
+def decrypt_many(keys, ciphertexts, letters, marker_mode):
+    return crypt_many(keys, ciphertexts, letters, marker_mode, True)
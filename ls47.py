@@ -6,11 +6,16 @@
 # Originally written by Mirek Kratochvil (2017)
 # Python3 port by Bernhard Esslinger (Feb 2018)
 
-import random
+import functools
+import os
 
 letters = "_abcdefghijklmnopqrstuvwxyz.0123456789,-+*/:?!'()"
 tiles = list(zip(letters, map(lambda x: (x // 7, x % 7), range(7 * 7))))
+letter_index = dict((l, i) for (i, l) in enumerate(letters))
 padding_size = 10
+key_cache_size = 256
+random_table = bytes(ord(letters[b % 49]) for b in range(256))
+random_reject = bytes(range(245, 256))
 
 
 def check_key(key):
@@ -35,6 +40,13 @@ def find_ix(letter):
         return pos
 
 
+def find_index(letter):
+    i = letter_index.get(letter)
+    if i is None:
+        raise ValueError('Letter ' + letter + ' not in LS47!')
+    return i
+
+
 def find_pos(key, letter):
     p = key.find(letter)
     if p >= 0 and p < 7 * 7:
@@ -84,7 +96,7 @@ def rotate_marker_down(m, col, n):
         return ((m[0] + n) % 7, m[1])
 
 
-def derive_key(password):
+def _derive_key(password):
     i = 0
     k = letters
     for c in password:
@@ -94,7 +106,11 @@ def derive_key(password):
     return k
 
 
-def encrypt(key, plaintext):
+def reference_encrypt(key, plaintext):
+    """
+    The original implementation of encrypt(), on key strings; slow, but kept
+    as the fixed reference for the optimized engines (see lc4corpus.py).
+    """
     check_key(key)
     mp = (0, 0)
     ciphertext = ''
@@ -112,7 +128,8 @@ def encrypt(key, plaintext):
     return ciphertext
 
 
-def decrypt(key, ciphertext):
+def reference_decrypt(key, ciphertext):
+    """The original implementation of decrypt(), see reference_encrypt()."""
     check_key(key)
     mp = (0, 0)
     plaintext = ''
@@ -130,20 +147,196 @@ def decrypt(key, ciphertext):
     return plaintext
 
 
+class LS47State:
+    """
+    Running state of the cipher: the board and the marker.
+
+    The board is kept as a bytearray of letter indices (board position ->
+    letter) together with the inverse table (letter -> board position), so
+    that looking up letters is O(1) and the rotations are done in place.
+    """
+
+    def __init__(self, key):
+        check_key(key)
+        self.board = bytearray(letter_index[c] for c in key)
+        self.pos = [0] * (7 * 7)
+        for i, l in enumerate(self.board):
+            self.pos[l] = i
+        self.mp = (0, 0)
+
+    def copy(self):
+        state = LS47State.__new__(LS47State)
+        state.board = bytearray(self.board)
+        state.pos = list(self.pos)
+        state.mp = self.mp
+        return state
+
+    def rotate_row(self, row):
+        b = self.board
+        base = 7 * row
+        last = b[base + 6]
+        b[base + 1:base + 7] = b[base:base + 6]
+        b[base] = last
+        for i in range(base, base + 7):
+            self.pos[b[i]] = i
+
+    def rotate_col(self, col):
+        b = self.board
+        last = b[col + 42]
+        b[col + 7::7] = b[col:col + 42:7]
+        b[col] = last
+        for i in range(col, 7 * 7, 7):
+            self.pos[b[i]] = i
+
+    def step(self, p, c):
+        self.rotate_row(self.pos[p] // 7)
+        self.rotate_col(self.pos[c] % 7)
+        self.mp = ((self.mp[0] + c // 7) % 7, (self.mp[1] + c % 7) % 7)
+
+    def encrypt(self, plaintext):
+        ciphertext = []
+        for l in plaintext:
+            p = find_index(l)
+            (pr, pc) = divmod(self.pos[p], 7)
+            mix = self.board[self.mp[0] * 7 + self.mp[1]]
+            c = self.board[(pr + mix // 7) % 7 * 7 + (pc + mix % 7) % 7]
+            ciphertext.append(letters[c])
+            self.step(p, c)
+        return ''.join(ciphertext)
+
+    def decrypt(self, ciphertext):
+        plaintext = []
+        for l in ciphertext:
+            c = find_index(l)
+            (cr, cc) = divmod(self.pos[c], 7)
+            mix = self.board[self.mp[0] * 7 + self.mp[1]]
+            p = self.board[(cr - mix // 7) % 7 * 7 + (cc - mix % 7) % 7]
+            plaintext.append(letters[p])
+            self.step(p, c)
+        return ''.join(plaintext)
+
+
+def encrypt(key, plaintext):
+    return LS47State(key).encrypt(plaintext)
+
+
+def decrypt(key, ciphertext):
+    return LS47State(key).decrypt(ciphertext)
+
+
+# derived keys are memoized in a bounded LRU cache (see set_key_cache_size)
+_derive_key_cached = functools.lru_cache(key_cache_size)(_derive_key)
+
+
+def derive_key(password):
+    return _derive_key_cached(password)
+
+
+def set_key_cache_size(n):
+    """Resize the derived key cache (dropping its contents); 0 disables it."""
+    global _derive_key_cached
+    _derive_key_cached = functools.lru_cache(n)(_derive_key)
+
+
+def key_cache_info():
+    """Hits, misses, maximum and current size of the derived key cache."""
+    return _derive_key_cached.cache_info()
+
+
+def clear_key_cache():
+    _derive_key_cached.cache_clear()
+
+
+@functools.lru_cache(64)
+def _prefix_snapshot(key, prefix, decrypting):
+    state = LS47State(key)
+    out = state.decrypt(prefix) if decrypting else state.encrypt(prefix)
+    return (state, out)
+
+
+def resume(key, prefix, decrypting=False):
+    """
+    State after encrypting (or decrypting) prefix with key, and the processed
+    prefix. Snapshots are cached, so repeated operations on the same key and
+    common header continue from there; random padding never repeats, so it
+    does not go through here. See clear_prefix_cache().
+    """
+    (state, out) = _prefix_snapshot(key, prefix, decrypting)
+    return (state.copy(), out)
+
+
+def clear_prefix_cache():
+    """Forget the snapshots of resume(), with the keys and boards they hold."""
+    _prefix_snapshot.cache_clear()
+
+
+def encrypt_many(keys, plaintexts, backend='python'):
+    """
+    Encrypt a list of independent messages, each with its key (or all with
+    the same key); backend='numpy' processes them in lockstep (lockstep.py).
+    """
+    return _crypt_many(keys, plaintexts, backend, encrypt)
+
+
+def decrypt_many(keys, ciphertexts, backend='python'):
+    return _crypt_many(keys, ciphertexts, backend, decrypt)
+
+
+def _crypt_many(keys, texts, backend, crypt):
+    if isinstance(keys, str):
+        keys = [keys] * len(texts)
+    if backend == 'numpy':
+        import lockstep
+        return lockstep.crypt_many(keys, texts, letters, 2, crypt is decrypt)
+    if backend != 'python':
+        raise ValueError('Unknown backend ' + backend)
+    return [crypt(k, t) for (k, t) in zip(keys, texts)]
+
+
+def random_letters(n):
+    """
+    n uniformly random letters from os.urandom; bytes >= 245 (5 * 49) are
+    rejected so that every letter is equally likely.
+    """
+    out = ''
+    while len(out) < n:
+        data = os.urandom(2 * n + 16)
+        out += data.translate(random_table, random_reject).decode('ascii')
+    return out[:n]
+
+
+def normalize(text):
+    """
+    Map free text into the alphabet (lowercase, no accents, whitespace as _,
+    other characters dropped); returns the text and the number of altered
+    characters. The mapping is the one of lc4.py --normalize (lc4.NormalizeTable).
+    """
+    import lc4
+    normalizer = lc4.Normalizer(lc4.get_alphabet(letters))
+    text = normalizer(text)
+    return (text, normalizer.altered)
+
+
 def encrypt_pad(key, plaintext, signature):
 
     # TODO it would also be great to randomize the message length.
 
     check_key(key)
-    padding = ''.join(map(lambda x: letters[random.randint(0,
-                      len(letters) - 1)], range(padding_size)))
+    padding = random_letters(padding_size)
 
     return encrypt(key, padding + plaintext + '---' + signature)
 
 
-def decrypt_pad(key, ciphertext):
+def decrypt_pad(key, ciphertext, signature=None):
+    """
+    Decrypt a message from encrypt_pad(); if signature is given, raise
+    ValueError unless the plaintext ends with '---' + signature.
+    """
     check_key(key)
-    return decrypt(key, ciphertext)[padding_size:]
+    plaintext = decrypt(key, ciphertext)[padding_size:]
+    if signature is not None and not plaintext.endswith('---' + signature):
+        raise ValueError('Signature mismatch')
+    return plaintext
 
 
 if __name__ == '__main__':
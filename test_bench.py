@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# This software is hereby released into public domain. Use it wisely.
+#
+# The benchmark cases of bench.py (derive_key, encrypt/decrypt of both
+# ciphers in both marker modes, the nonce and padding wrappers) under
+# pytest-benchmark, with its stored baselines and failure threshold; skipped
+# when pytest-benchmark is not installed. The letters per call of each case
+# are kept in extra_info, for letters per second.
+#
+# Sample calls:
+# python -m pytest test_bench.py --benchmark-autosave
+# python -m pytest test_bench.py --benchmark-compare --benchmark-compare-fail=mean:20%
+# // the other tests only
+# python -m pytest -q --benchmark-skip
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+import bench
+
+
+cases = list(bench.cases([10, 1000, 100000]))
+
+
+@pytest.mark.parametrize('name,letters,fn', cases, ids=[c[0] for c in cases])
+def test_benchmark(benchmark, name, letters, fn):
+    benchmark.extra_info['letters'] = letters
+    benchmark(fn)
@@ -0,0 +1,528 @@
+# -*- coding: utf-8 -*-
+# This software is hereby released into public domain. Use it wisely.
+#
+# Tests for lc4.py: known-answer vectors, the engine against a small copy of
+# the original string implementation (both marker and nonce modes), and the
+# stream, cache, normalize, binary, index, container, batch, checkpoint,
+# mmap and keyring features, including their error paths.
+#
+# python -m pytest -q
+
+import io
+import os
+import json
+import random
+import argparse
+
+import pytest
+
+import lc4
+import ls47
+
+
+# (size, marker mode, nonce mode, key or None, keyword or None, nonce, plaintext, ciphertext)
+vectors = [
+    (6, 1, 1, 's2ferw_nx346ty5odiupq#lmz8ajhgcvk79b', None, '',
+     'aaaaaaaaaaaaaaaaaaaa', 'tk5j23tq94_gw9c#lhzs'),
+    (6, 1, 1, None, 'thisismysecretkey', '',
+     'its_my_fathers_son_but_not_my_brother', '6dudfy3u7omoxy4jbscgn37c2se_d8gx6ogk9'),
+    (6, 1, 1, None, 'thisismysecretkey', 'q6xojf',
+     'its_my_fathers_son_but_not_my_brother', 'q6xojffkncfyz#f5czs49#3mbsco#2iscvbnm#bymaf'),
+    (7, 1, 2, None, 's3cret_p4ssw0rd/31337', "8y(l._4ct'",
+     'conflagrate_the_rose_bush_at_six!---peace-vector-3',
+     "y'zbvvs+d2,ky4sy?w(_wkz*7'90v:./s)kcz?mj+gyu8-'h(y,i+v,z+1ws"),
+    (6, 2, 1, None, 'thisismysecretkey', 'igxf5e', '##############', 'igxf5egcyhoo#ny#o5i5'),
+    (6, 1, 1, None, 'thisismysecretkey', 'igxf5e', '##############', 'igxf5e##############'),
+]
+
+
+# The original implementation (lc4.py before the State engine), on key
+# strings, for any size*size alphabet; marker mode 1 (Kaminsky) carries the
+# marker along with the rotations, 2 (Kratochvil) leaves it in place.
+
+def ref_crypt(letters, key, text, marker_mode, decrypting=False):
+    size = int(round(len(letters) ** 0.5))
+    tiles = dict((l, divmod(i, size)) for (i, l) in enumerate(letters))
+
+    def find_pos(key, letter):
+        return divmod(key.index(letter), size)
+
+    def find_at_pos(key, pos):
+        return key[pos[0] * size + pos[1]]
+
+    def rotate_right(key, row):
+        mid = key[size * row:size * (row + 1)]
+        return key[:size * row] + mid[-1:] + mid[:-1] + key[size * (row + 1):]
+
+    def rotate_down(key, col):
+        lines = [key[i * size:(i + 1) * size] for i in range(size)]
+        mids = [l[col] for l in lines]
+        mids = mids[-1:] + mids[:-1]
+        return ''.join(l[:col] + m + l[col + 1:] for (l, m) in zip(lines, mids))
+
+    mp = (0, 0)
+    out = ''
+    for x in text:
+        mix = tiles[find_at_pos(key, mp)]
+        if decrypting:
+            c = x
+            cp = find_pos(key, c)
+            pp = ((cp[0] - mix[0]) % size, (cp[1] - mix[1]) % size)
+            out += find_at_pos(key, pp)
+        else:
+            pp = find_pos(key, x)
+            c = find_at_pos(key, ((pp[0] + mix[0]) % size, (pp[1] + mix[1]) % size))
+            out += c
+        key = rotate_right(key, pp[0])
+        if marker_mode == 1 and mp[0] == pp[0]:
+            mp = (mp[0], (mp[1] + 1) % size)
+        cp = find_pos(key, c)
+        key = rotate_down(key, cp[1])
+        if marker_mode == 1 and mp[1] == cp[1]:
+            mp = ((mp[0] + 1) % size, mp[1])
+        t = tiles[c]
+        mp = ((mp[0] + t[0]) % size, (mp[1] + t[1]) % size)
+    return out
+
+
+def ref_derive_key(letters, password, one_indexed=False):
+    size = int(round(len(letters) ** 0.5))
+    k = letters[1:] + letters[0] if one_indexed else letters
+    for (i, c) in enumerate(password):
+        (row, col) = divmod(letters.index(c), size)
+        i %= size
+        mid = k[size * i:size * (i + 1)]
+        k = k[:size * i] + mid[-col:] + mid[:-col] + k[size * (i + 1):] if col else k
+        lines = [k[j * size:(j + 1) * size] for j in range(size)]
+        mids = [l[i] for l in lines]
+        mids = mids[-row:] + mids[:-row] if row else mids
+        k = ''.join(l[:i] + m + l[i + 1:] for (l, m) in zip(lines, mids))
+    return k
+
+
+def ref_encrypt_with_nonce(letters, key, plaintext, nonce, marker_mode, nonce_mode):
+    ciphertext = ref_crypt(letters, key, nonce + plaintext, marker_mode)
+    return nonce + ciphertext[len(nonce):] if nonce_mode == 1 else ciphertext
+
+
+def random_text(rnd, letters, n):
+    return ''.join(rnd.choice(letters) for i in range(n))
+
+
+def random_key(rnd, letters):
+    return ''.join(rnd.sample(letters, len(letters)))
+
+
+def configurations():
+    for letters in (lc4.letters6, lc4.letters7, lc4.letters6card, lc4.letters8):
+        for mm in (1, 2):
+            yield (letters, mm)
+
+
+@pytest.mark.parametrize('vector', vectors, ids=[v[6][:12] for v in vectors])
+def test_known_answers(vector):
+    (size, mm, nm, key, keyword, nonce, plaintext, ciphertext) = vector
+    cipher = lc4.Cipher(size, marker_mode=mm, nonce_mode=nm, key_cache=lc4.KeyCache(0))
+    if key is None:
+        key = cipher.derive_key(keyword)
+        assert key == ref_derive_key(cipher.letters, keyword)
+    assert cipher.encrypt_with_nonce(key, plaintext, nonce) == ciphertext
+    assert cipher.decrypt_with_nonce(key, ciphertext, len(nonce)) == plaintext
+    assert ref_encrypt_with_nonce(cipher.letters, key, plaintext, nonce, mm, nm) == ciphertext
+
+
+@pytest.mark.parametrize('letters,marker_mode', list(configurations()))
+def test_engine_matches_reference(letters, marker_mode):
+    rnd = random.Random(letters + str(marker_mode))
+    cipher = lc4.Cipher(alphabet=letters, marker_mode=marker_mode)
+    for i in range(20):
+        key = random_key(rnd, letters)
+        text = random_text(rnd, letters, rnd.randint(0, 200))
+        ciphertext = cipher.encrypt(key, text)
+        assert ciphertext == ref_crypt(letters, key, text, marker_mode)
+        assert cipher.decrypt(key, ciphertext) == text
+        assert cipher.decrypt(key, text) == ref_crypt(letters, key, text, marker_mode, True)
+
+
+@pytest.mark.parametrize('size,playingcard', [(6, False), (6, True), (7, False), (7, True)])
+def test_derive_key_matches_reference(size, playingcard):
+    rnd = random.Random(size * 2 + playingcard)
+    cipher = lc4.Cipher(size, playingcard, key_cache=lc4.KeyCache(0))
+    for i in range(20):
+        keyword = random_text(rnd, cipher.letters, rnd.randint(1, 40))
+        assert cipher.derive_key(keyword) == ref_derive_key(cipher.letters, keyword, playingcard)
+
+
+@pytest.mark.parametrize('size,marker_mode,nonce_mode', [(s, m, n) for s in (6, 7) for m in (1, 2) for n in (1, 2)])
+def test_nonce_modes(size, marker_mode, nonce_mode):
+    rnd = random.Random(size * 100 + marker_mode * 10 + nonce_mode)
+    cipher = lc4.Cipher(size, marker_mode=marker_mode, nonce_mode=nonce_mode)
+    for i in range(10):
+        key = random_key(rnd, cipher.letters)
+        nonce = random_text(rnd, cipher.letters, 10)
+        plaintext = random_text(rnd, cipher.letters, rnd.randint(0, 100))
+        ciphertext = cipher.encrypt_with_nonce(key, plaintext, nonce)
+        assert ciphertext == ref_encrypt_with_nonce(cipher.letters, key, plaintext, nonce, marker_mode, nonce_mode)
+        d = cipher.decryptor(key, len(nonce))
+        assert d.update(ciphertext) + d.final() == plaintext
+        assert d.nonce == nonce
+
+
+@pytest.mark.parametrize('size', [6, 7])
+def test_stream_chunks_and_restore(size):
+    rnd = random.Random(size)
+    cipher = lc4.Cipher(size)
+    key = cipher.derive_key('streaming')
+    nonce = cipher.create_random_nonce(10)
+    plaintext = random_text(rnd, cipher.letters, 1000)
+    ciphertext = cipher.encrypt_with_nonce(key, plaintext, nonce)
+    cuts = sorted(rnd.randint(0, 1000) for i in range(5))
+    parts = [plaintext[a:b] for (a, b) in zip([0] + cuts, cuts + [1000])]
+
+    e = cipher.encryptor(key, nonce)
+    out = e.update(parts[0])
+    # export in the middle and continue from a restored copy
+    e = lc4.StreamEncryptor.restore(cipher, json.loads(json.dumps(e.export())))
+    out += ''.join(e.update(p) for p in parts[1:]) + e.final()
+    assert out == ciphertext
+
+    d = cipher.decryptor(key, 10)
+    out = d.update(ciphertext[:3])
+    with pytest.raises(ValueError, match="before the nonce is complete"):
+        d.export()
+    out += d.update(ciphertext[3:500])
+    d = lc4.StreamDecryptor.restore(cipher, json.loads(json.dumps(d.export())))
+    out += d.update(ciphertext[500:]) + d.final()
+    assert out == plaintext
+
+
+def test_prefix_cache_is_opt_in():
+    cache = lc4.PrefixCache(8)
+    cipher = lc4.Cipher(6, prefix_cache=cache)
+    key = cipher.derive_key('prefix')
+    plaintext = 'its_my_fathers_son'
+    ciphertext = cipher.encrypt_with_nonce(key, plaintext, 'abcdef')
+    assert cipher.decrypt_with_nonce(key, ciphertext, 6) == plaintext
+    assert cache.stats()['size'] == 0
+    assert cipher.encrypt_with_nonce(key, plaintext, 'abcdef', cache=True) == ciphertext
+    assert cipher.encrypt_with_nonce(key, plaintext, 'abcdef', cache=True) == ciphertext
+    # Kaminsky nonce mode: decryption encrypts the nonce too, and shares the snapshot
+    assert cipher.decrypt_with_nonce(key, ciphertext, 6, cache=True) == plaintext
+    stats = cache.stats()
+    assert (stats['size'], stats['hits']) == (1, 2)
+
+
+def test_key_cache():
+    cache = lc4.KeyCache(2)
+    cipher = lc4.Cipher(6, key_cache=cache)
+    for keyword in ('one', 'two', 'one', 'three', 'two'):
+        assert cipher.derive_key(keyword) == ref_derive_key(cipher.letters, keyword)
+    stats = cache.stats()
+    assert (stats['size'], stats['hits'], stats['misses']) == (2, 1, 4)
+
+
+def test_invalid_input():
+    cipher = lc4.Cipher(6)
+    with pytest.raises(ValueError, match="duplicate letters: 'a'"):
+        cipher.check_key('a' + cipher.letters[:-1])
+    with pytest.raises(ValueError, match="Letter 'A' not in the alphabet"):
+        cipher.encrypt(cipher.letters, 'abcA')
+    with pytest.raises(ValueError, match="Plaintext contains illegal letters: 'A'"):
+        cipher.check_plaintext('abcA')
+    with pytest.raises(ValueError, match="Nonce contains illegal letters"):
+        cipher.check_nonce('xy!')
+    with pytest.raises(ValueError, match="size\\*size distinct letters"):
+        lc4.Cipher(alphabet='abcde')
+    with pytest.raises(ValueError, match="Unknown backend"):
+        cipher.encrypt_many(cipher.letters, ['abc'], 'fortran')
+
+
+def test_count_types():
+    assert lc4.positive('3') == 3
+    assert lc4.non_negative('0') == 0
+    for (convert, value) in ((lc4.positive, '0'), (lc4.positive, '-1'), (lc4.non_negative, '-1'), (lc4.positive, 'x')):
+        with pytest.raises(argparse.ArgumentTypeError):
+            convert(value)
+
+
+def test_trial():
+    cipher = lc4.Cipher(7)
+    key = cipher.derive_key('trial')
+    ciphertext = cipher.encrypt_with_nonce(key, 'attack_at_dawn---sig', 'abcdefghij')
+    assert cipher.trial(key, ciphertext, '---sig', -6, 10)
+    assert cipher.trial(key, ciphertext, 'attack', 0, 10)
+    assert not cipher.trial(key, ciphertext, 'defend', 0, 10)
+    assert not cipher.trial(cipher.derive_key('other'), ciphertext, '---sig', -6, 10)
+    assert cipher.trial(key, ciphertext, nonce_size=10, allowed=cipher.letters)
+    assert not cipher.trial(key, ciphertext, '---sig' * 10, -60, 10)
+
+
+@pytest.mark.parametrize('text,lc4_text,ls47_text', [
+    ('Hello World', 'hello_world', 'hello_world'),
+    ('Größe\tÉté', 'grosse_ete', 'grosse_ete'),
+    ('“quoted”', 'quoted', "'quoted'"),
+    ('2-10.5, ok', '25_ok', '2-10.5,_ok'),
+])
+def test_normalize(text, lc4_text, ls47_text):
+    # digits and punctuation have no transliteration: dropped, not replaced
+    normalizer = lc4.Cipher(6).normalizer()
+    assert normalizer(text) == lc4_text
+    assert ls47.normalize(text)[0] == ls47_text
+    assert lc4.Cipher(7).normalizer()(text) == ls47_text
+
+
+def test_normalize_counts_altered():
+    normalizer = lc4.Cipher(6).normalizer()
+    assert normalizer('already_fine') == 'already_fine'
+    assert normalizer.altered == 0
+    normalizer('Ab 1')
+    assert normalizer.altered == 3
+    assert ls47.normalize('Ab 1') == ('ab_1', 2)
+
+
+def test_normalizing_encryptor_keeps_signature():
+    cipher = lc4.Cipher(6)
+    key = cipher.derive_key('normalize')
+    s = lc4.NormalizingEncryptor(cipher.encryptor(key, 'abcdef'), cipher.normalizer(), '#sig')
+    ciphertext = s.update('Héllo ') + s.update('Wörld') + s.final()
+    assert cipher.decrypt_with_nonce(key, ciphertext, 6) == 'hello_world#sig'
+
+
+@pytest.mark.parametrize('letters', [lc4.letters6, lc4.letters7, lc4.letters8])
+def test_binary_codec(letters):
+    rnd = random.Random(len(letters))
+    alphabet = lc4.get_alphabet(letters)
+    for n in list(range(40)) + [1000]:
+        data = bytes(rnd.randrange(256) for i in range(n))
+        encoder = lc4.BinaryEncoder(alphabet)
+        text = ''.join(encoder.update(data[i:i + 7]) for i in range(0, n, 7)) + encoder.final()
+        decoder = lc4.BinaryDecoder(alphabet)
+        assert b''.join(decoder.update(text[i:i + 5]) for i in range(0, len(text), 5)) + decoder.final() == data
+    (k, m, tails) = lc4.binary_blocks(len(letters))
+    stray = [t for t in range(1, m) if t not in tails][:1]
+    if stray:
+        decoder = lc4.BinaryDecoder(alphabet)
+        decoder.update(letters[1] * (m + stray[0]))
+        with pytest.raises(ValueError, match="truncated"):
+            decoder.final()
+
+
+def test_index_and_range():
+    rnd = random.Random(5)
+    cipher = lc4.Cipher(7)
+    key = cipher.derive_key('index')
+    plaintext = random_text(rnd, cipher.letters, 2000)
+    index = io.StringIO()
+    s = lc4.IndexedEncryptor(cipher.encryptor(key, 'abcdefghij'), index, 128)
+    ciphertext = ''.join(s.update(plaintext[i:i + 300]) for i in range(0, 2000, 300)) + s.final()
+    assert ciphertext == cipher.encrypt_with_nonce(key, plaintext, 'abcdefghij')
+    index.seek(0)
+    idx = lc4.read_index(index)
+    for (start, stop) in ((0, 0), (0, 10), (127, 129), (1234, 1300), (1990, None), (2000, None)):
+        f = io.StringIO(ciphertext + '\n')
+        assert lc4.decrypt_range(idx, f, start, stop) == plaintext[start:stop]
+    with pytest.raises(ValueError, match="does not belong"):
+        lc4.decrypt_range(idx, io.StringIO('x' + ciphertext), 0, 10)
+    with pytest.raises(ValueError, match="Invalid range"):
+        lc4.decrypt_range(idx, io.StringIO(ciphertext), 10, 5)
+    with pytest.raises(ValueError, match="no snapshot"):
+        lc4.read_index(io.StringIO(index.getvalue().splitlines()[0] + '\n'))
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_container(jobs):
+    rnd = random.Random(jobs)
+    cipher = lc4.Cipher(6)
+    key = cipher.derive_key('container')
+    plaintext = random_text(rnd, cipher.letters, 1000)
+    out = io.StringIO()
+    lc4.encrypt_container(cipher, key, io.StringIO(plaintext + '\n'), out, 128, 6, jobs, '#sig')
+    container = out.getvalue()
+    assert container.startswith('LC4C 6\n') and container.endswith('END 8\n')
+    result = io.StringIO()
+    lc4.decrypt_container(cipher, key, io.StringIO(container), result, jobs, lc4.SignatureCheck('#sig', True))
+    assert result.getvalue() == plaintext + '\n'
+
+
+def test_container_errors():
+    cipher = lc4.Cipher(6)
+    key = cipher.derive_key('container')
+    with pytest.raises(ValueError, match="its own nonce"):
+        lc4.encrypt_container(cipher, key, io.StringIO('abc'), io.StringIO(), 128, 0, 1)
+    out = io.StringIO()
+    lc4.encrypt_container(cipher, key, io.StringIO('abcdefgh' * 10), out, 16, 6, 1)
+    lines = out.getvalue().splitlines(True)
+
+    def decrypt(text):
+        lc4.decrypt_container(cipher, key, io.StringIO(text), io.StringIO(), 1)
+
+    decrypt(''.join(lines))
+    with pytest.raises(ValueError, match="Not a container"):
+        decrypt(''.join(lines[1:]))
+    with pytest.raises(ValueError, match="without END"):
+        decrypt(''.join(lines[:-1]))
+    with pytest.raises(ValueError, match="chunk 1 is missing"):
+        decrypt(''.join(lines[:3] + lines[5:]))
+    with pytest.raises(ValueError, match="ends after 4 of 5"):
+        decrypt(''.join(lines[:-3] + lines[-1:]))
+    with pytest.raises(ValueError, match="truncated"):
+        decrypt(''.join(lines[:2] + [lines[2][3:]] + lines[3:]))
+
+
+def write_batch(path, lines):
+    with open(path, 'w') as f:
+        f.write(''.join(line + '\n' for line in lines))
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_batch(tmp_path, jobs):
+    cipher = lc4.Cipher(7)
+    key = cipher.derive_key('batch')
+    path = str(tmp_path / 'batch.jsonl')
+    messages = [json.dumps(dict(id='m%d' % i, text='message_%d' % i, nonce='nonc%02d' % i)) for i in range(100)]
+    write_batch(path, messages[:50] + ['not json', '', json.dumps(dict(id='bad', text='Bad!'))] + messages[50:])
+    job = lc4.BatchJob(cipher, key, True, signature='-sig')
+    results = list(lc4.batch(job, lc4.read_batch(path), jobs, chunksize=8))
+    assert [r['id'] for r in results[49:53]] == ['m49', 51, 'bad', 'm50']
+    assert results[50] == dict(id=51, error="Line 51: Expecting value: line 1 column 1 (char 0)")
+    assert 'illegal letters' in results[51]['error'] and 'nonce' not in results[51]
+    good = [r for r in results if 'error' not in r]
+    assert [r['text'] for r in good] == [cipher.encrypt_with_nonce(key, 'message_%d-sig' % i, 'nonc%02d' % i)
+                                         for i in range(100)]
+
+    write_batch(path, [json.dumps(dict(id=r['id'], text=r['text'])) for r in good[:10]] +
+                [json.dumps(dict(id='x', text=good[0]['text'][:6] + '2' * 10))])
+    results = list(lc4.batch(lc4.BatchJob(cipher, key, False, 6, '-sig'), lc4.read_batch(path), jobs))
+    assert [(r['text'], r['signature']) for r in results[:10]] == [('message_%d-sig' % i, True) for i in range(10)]
+    assert results[10]['signature'] is False
+
+
+def test_batch_directory(tmp_path):
+    (tmp_path / 'b.txt').write_text('second\n')
+    (tmp_path / 'a.txt').write_text('first')
+    (tmp_path / 'c.bin').write_bytes(b'\xff\xfe')
+    (tmp_path / 'sub').mkdir()
+    messages = list(lc4.read_batch(str(tmp_path)))
+    assert [m['id'] for m in messages] == ['a.txt', 'b.txt', 'c.bin']
+    assert [m.get('text') for m in messages[:2]] == ['first', 'second']
+    assert messages[2]['error'].startswith('c.bin: ')
+
+
+def test_checkpoint_resume(tmp_path):
+    rnd = random.Random(3)
+    cipher = lc4.Cipher(7)
+    key = cipher.derive_key('checkpoint')
+    nonce = cipher.create_random_nonce(10)
+    text = random_text(rnd, cipher.letters, 3000)
+    (tmp_path / 'pt.txt').write_text(text + '\n')
+    path = str(tmp_path / 'ck.json')
+    checkpoint = lc4.Checkpoint(path, 500, cipher, True, str(tmp_path / 'pt.txt'), str(tmp_path / 'ct.txt'), 256, '_sig')
+    chunks = []
+
+    def interrupt(chunk):
+        chunks.append(chunk)
+        if len(chunks) > 3:
+            raise KeyboardInterrupt()
+    with pytest.raises(KeyboardInterrupt):
+        lc4.stream(cipher.encryptor(key, nonce), interrupt, None, None, 256, '_sig', checkpoint)
+    assert os.stat(path).st_mode & 0o777 == 0o600
+
+    checkpoint = lc4.Checkpoint.load(path)
+    assert checkpoint.input == 512
+    job = checkpoint.job
+    lc4.stream(checkpoint.stream(), checkpoint.cipher.check_plaintext, None, None, job['chunk_size'],
+               job['signature'], checkpoint)
+    assert (tmp_path / 'ct.txt').read_text() == cipher.encrypt_with_nonce(key, text + '_sig', nonce) + '\n'
+    assert not os.path.exists(path)
+
+    with pytest.raises(ValueError, match="named input and output"):
+        lc4.Checkpoint(path, 500, cipher, True, '-', str(tmp_path / 'ct.txt'), 256)
+
+
+@pytest.mark.parametrize('n', [0, 1, 999, 5000])
+def test_mmap(tmp_path, n):
+    rnd = random.Random(n)
+    cipher = lc4.Cipher(7)
+    key = cipher.derive_key('mmap')
+    text = random_text(rnd, cipher.letters, n)
+    (tmp_path / 'pt.txt').write_text(text + '\r\n')
+    lc4.crypt_mmap(cipher.encryptor(key, 'abcdefghij'), cipher.check_plaintext, str(tmp_path / 'pt.txt'),
+                   str(tmp_path / 'ct.txt'), 256, True, '_sig')
+    ciphertext = (tmp_path / 'ct.txt').read_text()
+    assert ciphertext == cipher.encrypt_with_nonce(key, text + '_sig', 'abcdefghij') + '\n'
+    lc4.crypt_mmap(cipher.decryptor(key, 10), cipher.check_ciphertext, str(tmp_path / 'ct.txt'),
+                   str(tmp_path / 'out.txt'), 256, False)
+    assert (tmp_path / 'out.txt').read_text() == text + '_sig\n'
+
+
+def test_mmap_error_removes_output(tmp_path):
+    cipher = lc4.Cipher(6)
+    key = cipher.derive_key('mmap')
+    (tmp_path / 'pt.txt').write_text('a' * 5000 + 'A' + 'b' * 10)
+    (tmp_path / 'ct.txt').write_text('old contents')
+    with pytest.raises(ValueError, match="illegal letters: 'A'"):
+        lc4.crypt_mmap(cipher.encryptor(key, ''), cipher.check_plaintext, str(tmp_path / 'pt.txt'),
+                       str(tmp_path / 'ct.txt'), 1024, True)
+    assert not os.path.exists(str(tmp_path / 'ct.txt'))
+
+
+def test_keyring(tmp_path):
+    path = str(tmp_path / 'keys.lc4k')
+    cipher6 = lc4.Cipher(6)
+    cipher7 = lc4.Cipher(7)
+    keywords = dict(alice='thisismysecretkey', bob='another_keyword', carol='third_one')
+    assert lc4.update_keyring(path, cipher6, keywords) == (3, 0, 0, 0)
+    assert lc4.update_keyring(path, cipher7, dict(alice='s3cret_p4ssw0rd/31337')) == (1, 0, 0, 0)
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    assert lc4.update_keyring(path, cipher6, dict(keywords, bob='changed_it'), ['carol', 'nobody']) == (0, 1, 2, 1)
+
+    keyring = lc4.Keyring(path, cipher6.alphabet)
+    assert list(keyring) == ['alice', 'bob']
+    assert keyring['alice'] == cipher6.derive_key('thisismysecretkey')
+    assert keyring['bob'] == cipher6.derive_key('changed_it')
+    for id in ('carol', 'x' * 100, ''):
+        with pytest.raises(KeyError):
+            keyring[id]
+    keyring.close()
+    keyring = lc4.Keyring(path, cipher7.alphabet)
+    assert dict(keyring) == dict(alice=ls47._derive_key('s3cret_p4ssw0rd/31337'))
+
+    router = lc4.Router(cipher7, keyring, 10, '---sig', -6)
+    ciphertext = cipher7.encrypt_with_nonce(keyring['alice'], 'hello---sig', 'abcdefghij')
+    assert router.route(ciphertext) == ['alice']
+    assert router.route(cipher7.encrypt_with_nonce(cipher7.derive_key('x'), 'hello---sig', 'abcdefghij')) == []
+    keyring.close()
+
+    with pytest.raises(ValueError, match="too long"):
+        lc4.update_keyring(path, cipher6, {'x' * 65: 'keyword'})
+    (tmp_path / 'empty').write_bytes(b'')
+    with pytest.raises(ValueError, match="Not a keyring"):
+        lc4.Keyring(str(tmp_path / 'empty'), cipher6.alphabet)
+    with open(path, 'rb') as f:
+        (tmp_path / 'cut').write_bytes(f.read()[:-10])
+    with pytest.raises(ValueError, match="Truncated"):
+        lc4.Keyring(str(tmp_path / 'cut'), cipher6.alphabet)
+
+
+def test_profile(tmp_path):
+    profile = lc4.Profile()
+    cipher = lc4.Cipher(6, profile=profile)
+    key = cipher.derive_key('profile')
+    assert cipher.decrypt(key, cipher.encrypt(key, 'its_my_fathers_son')) == 'its_my_fathers_son'
+    path = str(tmp_path / 'profile.json')
+    profile.dump(path)
+    with open(path) as f:
+        report = json.load(f)
+    assert report['counts']['letters'] == 36
+    assert set(lc4.Profile.phases) <= set(report['seconds'])
+
+
+def test_numpy_backend():
+    pytest.importorskip('numpy')
+    rnd = random.Random(8)
+    for (letters, mm) in configurations():
+        cipher = lc4.Cipher(alphabet=letters, marker_mode=mm)
+        keys = [random_key(rnd, letters) for i in range(10)]
+        texts = [random_text(rnd, letters, rnd.randint(0, 50)) for i in range(10)]
+        assert cipher.encrypt_many(keys, texts, 'numpy') == [ref_crypt(letters, k, t, mm) for (k, t) in zip(keys, texts)]
+        assert cipher.decrypt_many(keys, texts, 'numpy') == cipher.decrypt_many(keys, texts)
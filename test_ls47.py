@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# This software is hereby released into public domain. Use it wisely.
+#
+# Tests for ls47.py: the LS47State engine against the original string
+# implementation (reference_encrypt/reference_decrypt), the padding and
+# signature wrappers and the caches.
+#
+# python -m pytest -q
+
+import random
+
+import pytest
+
+import ls47
+
+
+ls47key = "-bg*jdv!erahkn':ziq?um(c)2s30,9ply6+1oxw_.58ft/74"
+
+
+def random_text(rnd, n):
+    return ''.join(rnd.choice(ls47.letters) for i in range(n))
+
+
+def random_key(rnd):
+    return ''.join(rnd.sample(ls47.letters, len(ls47.letters)))
+
+
+def test_derive_key():
+    assert ls47._derive_key('s3cret_p4ssw0rd/31337') == ls47key
+    assert ls47.derive_key('s3cret_p4ssw0rd/31337') == ls47key
+    assert ls47._derive_key('') == ls47.letters
+
+
+def test_engine_matches_reference():
+    rnd = random.Random(47)
+    for i in range(50):
+        key = random_key(rnd)
+        text = random_text(rnd, rnd.randint(0, 200))
+        ciphertext = ls47.reference_encrypt(key, text)
+        assert ls47.encrypt(key, text) == ciphertext
+        assert ls47.decrypt(key, ciphertext) == text
+        assert ls47.decrypt(key, text) == ls47.reference_decrypt(key, text)
+
+
+def test_invalid_input():
+    with pytest.raises(ValueError, match="Wrong key size"):
+        ls47.encrypt(ls47.letters[1:], 'abc')
+    with pytest.raises(ValueError, match="duplicated in key"):
+        ls47.encrypt('a' + ls47.letters[1:], 'abc')
+    with pytest.raises(ValueError, match="not in LS47"):
+        ls47.encrypt(ls47.letters, 'abC')
+    with pytest.raises(ValueError, match="not in LS47"):
+        ls47.derive_key('#')
+
+
+def test_pad_and_signature():
+    key = ls47.derive_key('s3cret_p4ssw0rd/31337')
+    ciphertexts = set()
+    for i in range(5):
+        ciphertext = ls47.encrypt_pad(key, 'conflagrate_the_rose_bush_at_six!', 'peace-vector-3')
+        assert len(ciphertext) == ls47.padding_size + 33 + 3 + 14
+        assert ls47.decrypt_pad(key, ciphertext, 'peace-vector-3') == 'conflagrate_the_rose_bush_at_six!---peace-vector-3'
+        ciphertexts.add(ciphertext)
+    assert len(ciphertexts) == 5
+    with pytest.raises(ValueError, match="Signature mismatch"):
+        ls47.decrypt_pad(key, ciphertext, 'peace-vector-4')
+    with pytest.raises(ValueError, match="Signature mismatch"):
+        ls47.decrypt_pad(key, ciphertext[:-1] + ('a' if ciphertext[-1] != 'a' else 'b'), 'peace-vector-3')
+
+
+def test_random_letters():
+    text = ls47.random_letters(10000)
+    assert len(text) == 10000
+    assert set(text) == set(ls47.letters)
+    assert ls47.random_letters(0) == ''
+
+
+def test_key_cache():
+    ls47.set_key_cache_size(2)
+    try:
+        for keyword in ('one', 'two', 'one', 'three', 'two'):
+            assert ls47.derive_key(keyword) == ls47._derive_key(keyword)
+        info = ls47.key_cache_info()
+        assert (info.hits, info.misses, info.currsize) == (1, 4, 2)
+        ls47.clear_key_cache()
+        assert ls47.key_cache_info().currsize == 0
+    finally:
+        ls47.set_key_cache_size(ls47.key_cache_size)
+
+
+def test_resume():
+    key = ls47.derive_key('header')
+    ls47.clear_prefix_cache()
+    for i in range(3):
+        (state, out) = ls47.resume(key, 'common_header_')
+        assert out + state.encrypt('body') == ls47.encrypt(key, 'common_header_body')
+    (state, out) = ls47.resume(key, out, True)
+    assert out == 'common_header_'
+    info = ls47._prefix_snapshot.cache_info()
+    assert (info.hits, info.currsize) == (2, 2)
+    ls47.clear_prefix_cache()
+    assert ls47._prefix_snapshot.cache_info().currsize == 0
+    ls47.decrypt_pad(key, ls47.encrypt_pad(key, 'x', 'y'))
+    assert ls47._prefix_snapshot.cache_info().currsize == 0
+
+
+def test_normalize():
+    assert ls47.normalize('conflagrate_the_rose') == ('conflagrate_the_rose', 0)
+    assert ls47.normalize('Ça va? Très bien!') == ('ca_va?_tres_bien!', 6)
+    assert ls47.normalize('tab\there\n') == ('tab_here_', 2)
+
+
+@pytest.mark.parametrize('backend', ['python', 'numpy'])
+def test_crypt_many(backend):
+    if backend == 'numpy':
+        pytest.importorskip('numpy')
+    rnd = random.Random(7)
+    keys = [random_key(rnd) for i in range(20)]
+    texts = [random_text(rnd, rnd.randint(0, 60)) for i in range(20)]
+    ciphertexts = ls47.encrypt_many(keys, texts, backend)
+    assert ciphertexts == [ls47.reference_encrypt(k, t) for (k, t) in zip(keys, texts)]
+    assert ls47.decrypt_many(keys, ciphertexts, backend) == texts
+    assert ls47.encrypt_many(keys[0], texts, backend) == [ls47.reference_encrypt(keys[0], t) for t in texts]
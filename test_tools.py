@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+# This software is hereby released into public domain. Use it wisely.
+#
+# Tests for the command line tools: round trips through the lc4.py file
+# formats and options (--stream from stdin, --binary, --container,
+# --index/--range, --checkpoint/--resume, --mmap, batches and keyrings)
+# and their option errors, the lc4server.py request handling, lc4audit.py
+# and lc4corpus.py.
+#
+# python -m pytest -q
+
+import os
+import sys
+import json
+import random
+import signal
+import asyncio
+import subprocess
+import concurrent.futures
+
+import pytest
+
+import lc4
+import ls47
+import lc4server
+
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+opts = ['-7', '-ws', 'bench', '-nl', '10', '--chunk-size', '256']
+sig = ['-s=_sig']
+
+
+def run(cwd, args, stdin='', status=0, tool='lc4.py'):
+    p = subprocess.run([sys.executable, os.path.join(here, tool)] + args, cwd=str(cwd), input=stdin,
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    assert p.returncode == status, p.stderr
+    return p.stdout if status == 0 else p.stderr
+
+
+@pytest.fixture
+def text(tmp_path):
+    rnd = random.Random(9)
+    text = ''.join(rnd.choice(ls47.letters) for i in range(3000))
+    (tmp_path / 'pt.txt').write_text(text + '\n')
+    return text
+
+
+def test_sample_calls(tmp_path):
+    out = run(tmp_path, ['-6', '-ws', 'thisismysecretkey', '-ds', 'q6xojffkncfyz#f5czs49#3mbsco#2iscvbnm#bymaf', '-nl', '6'])
+    assert out == 'its_my_fathers_son_but_not_my_brother\n'
+    out = run(tmp_path, ['-7', '-ws', 's3cret_p4ssw0rd/31337', '-m0', '-nl', '10', '-ds',
+                         "y'zbvvs+d2,ky4sy?w(_wkz*7'90v:./s)kcz?mj+gyu8-'h(y,i+v,z+1ws"])
+    assert out == 'conflagrate_the_rose_bush_at_six!---peace-vector-3\n'
+    # the self test of the original script, which exits with status 1
+    out = run(tmp_path, ['-t'], status=1)
+    assert "CIPHERTEXT: oa(c(??-,'hf(lhj*_uwmkgl/hs3s:eycn9,+kt*9+f" in out
+    assert 'CIPHERTEXT: pjpm5ilnw7nhgh8jz82wu4lj_eohaoouuux6oi5lo3j' in out
+
+
+def test_stream_stdin(tmp_path, text):
+    ciphertext = run(tmp_path, opts + ['--stream', '-ef', '-'] + sig, text)
+    assert run(tmp_path, opts + ['--stream', '-df', '-'] + sig, ciphertext) == text + '_sig\n'
+    run(tmp_path, opts + ['--stream', '-df', '-', '-s=_bad'], ciphertext, 3)
+
+
+def test_binary(tmp_path):
+    rnd = random.Random(1)
+    data = bytes(rnd.randrange(256) for i in range(1000))
+    (tmp_path / 'bin.dat').write_bytes(data)
+    run(tmp_path, opts + ['--binary', '-ef', 'bin.dat', '-o', 'bin.ct'] + sig)
+    run(tmp_path, opts + ['--binary', '-df', 'bin.ct', '-o', 'bin.out'] + sig)
+    assert (tmp_path / 'bin.out').read_bytes() == data
+
+
+def test_container(tmp_path, text):
+    run(tmp_path, opts + ['--container', '-j', '2', '-ef', 'pt.txt', '-o', 'c.lc4c'] + sig)
+    assert run(tmp_path, opts + ['--container', '-j', '1', '-df', 'c.lc4c'] + sig) == text + '_sig\n'
+
+
+def test_index_range(tmp_path, text):
+    run(tmp_path, opts + ['--index', 'i.idx', '--index-every', '100', '-ef', 'pt.txt', '-o', 'i.ct'])
+    assert os.stat(str(tmp_path / 'i.idx')).st_mode & 0o777 == 0o600
+    assert run(tmp_path, opts + ['--index', 'i.idx', '--range', '1234:1300', '-df', 'i.ct']) == text[1234:1300] + '\n'
+    assert run(tmp_path, opts + ['-df', 'i.ct']) == text + '\n'
+
+
+def test_resume(tmp_path, text):
+    # a checkpointed job, interrupted after the third chunk, then resumed
+    cipher = lc4.Cipher(7)
+    key = cipher.derive_key('bench')
+    nonce = cipher.create_random_nonce(10)
+    chunks = []
+
+    def check(chunk):
+        chunks.append(chunk)
+        if len(chunks) > 3:
+            raise KeyboardInterrupt()
+    checkpoint = lc4.Checkpoint(str(tmp_path / 'ck.json'), 500, cipher, True, str(tmp_path / 'pt.txt'),
+                                str(tmp_path / 'ck.ct'), 256, '_sig')
+    with pytest.raises(KeyboardInterrupt):
+        lc4.stream(cipher.encryptor(key, nonce), check, None, None, 256, '_sig', checkpoint)
+    run(tmp_path, ['--resume', 'ck.json'])
+    assert (tmp_path / 'ck.ct').read_text() == cipher.encrypt_with_nonce(key, text + '_sig', nonce) + '\n'
+
+
+def test_mmap(tmp_path, text):
+    run(tmp_path, opts + ['--mmap', '-ef', 'pt.txt', '-o', 'm.ct'] + sig)
+    run(tmp_path, opts + ['--mmap', '-df', 'm.ct', '-o', 'm.pt'] + sig)
+    assert (tmp_path / 'm.pt').read_text() == text + '_sig\n'
+
+
+def test_batch(tmp_path, text):
+    (tmp_path / 'b.jsonl').write_text(''.join(json.dumps(dict(id=i, text=text[i * 100:i * 100 + 100])) + '\n'
+                                              for i in range(20)))
+    (tmp_path / 'b.ct').write_text(run(tmp_path, opts + ['-eb', 'b.jsonl', '-j', '2'] + sig))
+    results = [json.loads(line) for line in run(tmp_path, opts + ['-db', 'b.ct', '-j', '1'] + sig).splitlines()]
+    assert [(r['id'], r['text'], r['signature']) for r in results] == \
+        [(i, text[i * 100:i * 100 + 100] + '_sig', True) for i in range(20)]
+
+
+def test_keyring(tmp_path, text):
+    (tmp_path / 'kw.json').write_text(json.dumps(dict(alice='bench', bob='other')))
+    run(tmp_path, ['ring', '-7', '--add', 'kw.json'], tool='lc4keyring.py')
+    assert run(tmp_path, ['-7', '--keyring', 'ring', '-ki', 'alice', '-es', text]) == \
+        run(tmp_path, ['-7', '-ws', 'bench', '-es', text])
+    assert run(tmp_path, ['ring', '-7', '--list'], tool='lc4keyring.py') == 'alice\nbob\n'
+    assert run(tmp_path, ['ring', '--list'], tool='lc4keyring.py') == ''
+    run(tmp_path, ['ring', '-7', '--remove', 'alice', '--remove', 'bob'], tool='lc4keyring.py')
+    assert run(tmp_path, ['ring', '-7', '--list'], tool='lc4keyring.py') == ''
+    run(tmp_path, ['-7', '--keyring', 'ring', '-ki', 'alice', '-es', text], status=2)
+    run(tmp_path, ['missing', '--list'], status=2, tool='lc4keyring.py')
+
+
+def test_normalize(tmp_path):
+    assert run(tmp_path, ['-6', '-ws', 'key', '-ns', 'abcdef', '--normalize', '-es', 'Héllo Wörld 10']) == \
+        run(tmp_path, ['-6', '-ws', 'key', '-ns', 'abcdef', '-es', 'hello_world_'])
+
+
+@pytest.mark.parametrize('args,message', [
+    (['--chunk-size', '0', '--stream', '-ef', 'pt.txt'], "--chunk-size: must be an integer >= 1: '0'"),
+    (['--index-every', '0', '--index', 'i.idx', '-ef', 'pt.txt'], "--index-every: must be an integer >= 1"),
+    (['--checkpoint-every=-5', '-ef', 'pt.txt'], "--checkpoint-every: must be an integer >= 1"),
+    (['-nl=-1', '-es', 'abc'], "--noncelen: must be an integer >= 0"),
+    (['-j', 'x', '-eb', 'b.jsonl'], "--jobs: must be an integer >= 1: 'x'"),
+    (['--normalize', '-ds', 'abc'], "--normalize requires -es or -ef"),
+    (['--mmap', '-ef', 'pt.txt'], "--mmap requires -ef or -df with a named FILE, and -o FILE"),
+    (['--mmap', '--normalize', '-ef', 'pt.txt', '-o', 'x'], "--mmap cannot be combined"),
+    (['--checkpoint', 'ck.json', '--normalize', '--stream', '-ef', 'pt.txt', '-o', 'x'], "--normalize cannot be combined"),
+    (['--container', '-ef', 'pt.txt'], "--container requires -nl"),
+])
+def test_option_errors(tmp_path, text, args, message):
+    assert message in run(tmp_path, ['-7', '-ws', 'bench'] + args, status=2)
+    assert not os.path.exists(str(tmp_path / 'x'))
+
+
+def test_tool_option_errors(tmp_path):
+    assert "--max-line: must be an integer >= 1" in run(tmp_path, ['--port', '4747', '--max-line', '0'], status=2,
+                                                         tool='lc4server.py')
+    (tmp_path / 'file').write_text('')
+    assert "exists and is not a socket" in run(tmp_path, ['--unix', 'file'], status=2, tool='lc4server.py')
+    assert (tmp_path / 'file').exists()
+    assert "--chunk: must be an integer >= 1" in run(tmp_path, ['-ds', 'abc', '--known', 'a', '-w', 'w', '--chunk', '0'],
+                                                     status=2, tool='lc4audit.py')
+    assert "--batch: must be an integer >= 1" in run(tmp_path, ['--batch', '0'], status=2, tool='lc4corpus.py')
+
+
+def test_audit(tmp_path):
+    cipher = lc4.Cipher(6)
+    ciphertext = cipher.encrypt_with_nonce(cipher.derive_key('secret'), 'attn_hello', 'abcdef')
+    (tmp_path / 'words.txt').write_text(''.join('w%d\n' % i for i in range(3000)) + 'secret\n\nSecret!\n')
+    out = run(tmp_path, ['-6', '-nl', '6', '-ds', ciphertext, '--known', 'attn_', '-w', 'words.txt', '-j', '2',
+                         '--chunk', '100'], tool='lc4audit.py')
+    assert out == 'HIT       : secret\n'
+
+
+def test_corpus(tmp_path):
+    run(tmp_path, ['-n', '300', '--seed', '47', '-l', '30', '-j', '2', '--batch', '50', '--engines', 'ls47,lc4,lc4-stream',
+                   '-o', 'corpus.jsonl.gz'], tool='lc4corpus.py')
+    run(tmp_path, ['--check', 'corpus.jsonl.gz', '-j', '1', '--engines', 'lc4'], tool='lc4corpus.py')
+
+
+def request(server, req):
+    return json.loads(asyncio.run(server.respond(json.dumps(req))))
+
+
+def test_server_requests():
+    server = lc4server.Server(None, 0)
+    key = ls47.derive_key('s3cret_p4ssw0rd/31337')
+    r = request(server, dict(id=1, op='encrypt', size=7, m=0, keyword='s3cret_p4ssw0rd/31337', nonce="8y(l._4ct'",
+                             text='conflagrate_the_rose_bush_at_six!---peace', signature='-vector-3'))
+    assert r == dict(id=1, nonce="8y(l._4ct'", text="y'zbvvs+d2,ky4sy?w(_wkz*7'90v:./s)kcz?mj+gyu8-'h(y,i+v,z+1ws")
+    r = request(server, dict(id=2, op='decrypt', size=7, m=0, key=key, noncelen=10, text=r['text']))
+    assert r == dict(id=2, nonce="8y(l._4ct'", text='conflagrate_the_rose_bush_at_six!---peace-vector-3')
+    assert request(server, dict(id=3, op='derive', alphabet='ls47', keyword='s3cret_p4ssw0rd/31337')) == dict(id=3, key=key)
+    r = request(server, dict(op='encrypt', keyword='abc', text='hello', noncelen=6))
+    assert len(r['nonce']) == 6 and r['text'].startswith(r['nonce'])
+    stats = request(server, dict(op='stats'))
+    assert stats['metrics']['encrypt']['count'] == 2
+    assert stats['key_cache']['size'] == 2
+
+
+@pytest.mark.parametrize('req,message', [
+    ([], "A request must be a JSON object"),
+    (dict(id=5, op='nope'), "Unknown op: 'nope'"),
+    (dict(op='encrypt', size=8, keyword='a', text='a'), "size must be 6 or 7"),
+    (dict(op='encrypt', alphabet='abcd', keyword='a', text='a'), "Unknown alphabet: 'abcd'"),
+    (dict(op='encrypt', n=2, keyword='a', text='a'), "n and m must be 0 or 1"),
+    (dict(op='encrypt', text='a'), "A key or a keyword is required"),
+    (dict(op='encrypt', keyword='a'), "A text is required"),
+    (dict(op='encrypt', keyword='a', text='a', noncelen=5000), "noncelen must be an integer from 0 to 1024"),
+    (dict(op='encrypt', keyword='a', text='a', noncelen=True), "noncelen must be an integer"),
+    (dict(op='encrypt', keyword='a', text='A'), "Plaintext contains illegal letters: 'A'"),
+    (dict(op='decrypt', key='abc', text='a'), "Key misses some letters"),
+])
+def test_server_errors(req, message):
+    server = lc4server.Server(None, 0)
+    r = request(server, req)
+    assert message in r['error']
+    assert r.get('id') == (req.get('id') if isinstance(req, dict) else None)
+    assert sum(m['errors'] for m in server.metrics.report().values()) == 1
+
+
+def test_server_invalid_json():
+    server = lc4server.Server(None, 0)
+    assert 'error' in json.loads(asyncio.run(server.respond('{"op": ')))
+    assert list(server.metrics.report()) == ['invalid']
+
+
+def test_server_rebuilds_broken_pool():
+    pool = concurrent.futures.ProcessPoolExecutor(1)
+    server = lc4server.Server(pool, 0, jobs=1)
+    req = dict(op='encrypt', keyword='abc', text='hello', nonce='abcdef')
+    expected = request(server, req)
+    assert 'text' in expected
+    for pid in list(pool._processes):
+        os.kill(pid, signal.SIGKILL)
+    assert request(server, dict(req, keyword='abcd')) == dict(error="worker pool failed")
+    assert server.pool is not pool
+    try:
+        assert request(server, req) == expected
+    finally:
+        server.pool.shutdown()